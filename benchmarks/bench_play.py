@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+""" Measure the time from pressing Enter on a stream to the first media bytes
+
+A local HLS stand-in (hls_server.py) serves synthetic live streams, the
+localhls streamlink plugin (plugins/) resolves them and a dummy player
+(dummy_player.py) reports when the first bytes reach it. Streams are
+started through StreamList.play_stream, exactly like the Enter key does,
+for each launch mode:
+
+    streamlink : spawn STREAMLINK_COMMANDS, streamlink feeds the player
+    relay      : fetch in-process through RELAY_PLAYER (see relay.py)
+
+Requires streamlink. Results are written as JSON.
+
+    python benchmarks/bench_play.py --runs 20 --latency 0.05 --bandwidth 4000000
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from os.path import join, dirname, abspath
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+benchdir = dirname(abspath(__file__))
+sys.path.insert(0, join(dirname(benchdir), 'src'))
+sys.path.insert(0, benchdir)
+
+import headless
+from hls_server import HLSServer
+from bench_streamlist import git_revision
+from livestreamer_curses import config
+from livestreamer_curses import streamlist
+
+MODES = ['streamlink', 'relay']
+PLUGINS_DIR = join(benchdir, 'plugins')
+DUMMY_PLAYER = join(benchdir, 'dummy_player.py')
+
+def load_plugins(session, path):
+    try:
+        session.plugins.load_path(path)
+    except AttributeError:
+        session.load_plugins(path)
+
+def distribution(samples):
+    """ Summary statistics of a list of latencies, in seconds """
+    if not samples:
+        return None
+    s = sorted(samples)
+    def pct(p):
+        return s[min(len(s) - 1, int(round(p * (len(s) - 1))))]
+    return {
+        'min'  : s[0],
+        'p50'  : pct(.5),
+        'p90'  : pct(.9),
+        'p99'  : pct(.99),
+        'max'  : s[-1],
+        'mean' : sum(s) / len(s),
+    }
+
+def wait_report(path, tag, timeout):
+    """ Wait for the dummy player line tagged with tag, None on timeout """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    r = json.loads(line)
+                    if r['tag'] == tag:
+                        return r
+        time.sleep(0.005)
+    return None
+
+def run_mode(mode, args, server, tmpdir, report_path):
+    player_args = '{0} --bytes {1} --tag {{{{name}}}}'.format(quote(DUMMY_PLAYER), args.bytes)
+    if mode == 'streamlink':
+        # streamlink substitutes {playerinput} itself
+        config.STREAMLINK_COMMANDS = ['{0} {1} -p {2} -a {3}'.format(
+                args.streamlink, args.streamlink_args.format(plugins=quote(PLUGINS_DIR)),
+                quote(sys.executable), quote(player_args + ' {playerinput}'))]
+        config.RELAY_PLAYER = None
+    else:
+        config.RELAY_PLAYER = '{0} {1} -'.format(quote(sys.executable), player_args)
+
+    streams = [{
+        'name' : '{0}{1}'.format(mode, i),
+        'url'  : 'localhls://127.0.0.1:{0}/{1}{2}'.format(server.port, mode, i),
+        'res'  : args.res,
+    } for i in range(args.runs)]
+    l = streamlist.StreamList(join(tmpdir, '{0}.db'.format(mode)), config, init_stream_list=streams)
+    load_plugins(l.streamlink, PLUGINS_DIR)
+    l.init(headless.Window(50, 200))
+
+    samples = []
+    failures = 0
+    try:
+        for s in list(l.streams):
+            l.move(l.filtered_rows[s.id], absolute=True)
+            t0 = time.time()
+            l.play_stream()
+            r = wait_report(report_path, s.name, args.timeout)
+            if r is None or r['first_byte'] is None:
+                failures += 1
+            else:
+                samples.append(r['first_byte'] - t0)
+            l.q.terminate_process(s.id)
+            time.sleep(args.pause)
+    finally:
+        l.q.terminate()
+        l.checks.stop()
+        l.store.close()
+
+    return {
+        'runs'     : args.runs,
+        'failures' : failures,
+        'latency'  : distribution(samples),
+        'samples'  : samples,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the start latency of streams.')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma separated launch modes. default: %(default)s')
+    parser.add_argument('--runs', type=int, default=10, help='streams started per mode. default: %(default)s')
+    parser.add_argument('--latency', type=float, default=0.02, help='server latency per request, in seconds. default: %(default)s')
+    parser.add_argument('--bandwidth', type=int, default=0, help='server bandwidth per response, in bytes/s, 0 for no limit. default: %(default)s')
+    parser.add_argument('--segment-duration', type=float, default=2.0, help='default: %(default)s')
+    parser.add_argument('--segment-size', type=int, default=256*1024, help='in bytes. default: %(default)s')
+    parser.add_argument('--res', default='480p', help='quality to play. default: %(default)s')
+    parser.add_argument('--bytes', type=int, default=188, help='bytes the player waits for. default: %(default)s')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a player. default: %(default)s')
+    parser.add_argument('--pause', type=float, default=0.2, help='seconds between two runs. default: %(default)s')
+    parser.add_argument('--streamlink', default='streamlink', help='streamlink executable. default: %(default)s')
+    parser.add_argument('--streamlink-args', default='--plugin-dirs {plugins}',
+                        help='extra streamlink arguments, {plugins} is the plugin directory. default: %(default)s')
+    parser.add_argument('-o', '--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LINES', '50')
+    os.environ.setdefault('COLUMNS', '200')
+    streamlist.curses = headless
+
+    # Measure without the HTTP cache, and never use the one of the user
+    config.HTTP_CACHE_SIZE = 0
+    tmpdir = tempfile.mkdtemp(prefix='livestreamer-curses-play-')
+    report_path = join(tmpdir, 'players.ndjson')
+    os.environ['PLAY_LATENCY_REPORT'] = report_path
+    server = HLSServer(0, args.latency, args.bandwidth, args.segment_duration, args.segment_size).start()
+
+    report = {
+        'revision' : git_revision(),
+        'python'   : platform.python_version(),
+        'platform' : platform.platform(),
+        'server'   : {
+            'latency'          : args.latency,
+            'bandwidth'        : args.bandwidth,
+            'segment_duration' : args.segment_duration,
+            'segment_size'     : len(server.segment),
+        },
+        'modes'    : {},
+    }
+    try:
+        for mode in args.modes.split(','):
+            sys.stderr.write('starting {0} streams in {1} mode...\n'.format(args.runs, mode))
+            report['modes'][mode] = run_mode(mode, args, server, tmpdir, report_path)
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        sys.stdout.write(out + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+""" Benchmark the data and rendering hot paths of StreamList
+
+Synthetic stream databases are generated for each requested size and the
+main StreamList operations are timed against a headless curses stand-in.
+Results are written as JSON so that runs from different commits can be
+compared with --compare.
+
+    python benchmarks/bench_streamlist.py --sizes 1000,10000 -o before.json
+    python benchmarks/bench_streamlist.py --sizes 1000,10000 --compare before.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shelve
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from os.path import join, dirname, abspath
+
+srcdir = join(dirname(dirname(abspath(__file__))), 'src')
+sys.path.insert(0, srcdir)
+sys.path.insert(0, dirname(abspath(__file__)))
+
+import headless
+from livestreamer_curses import config
+from livestreamer_curses import streamlist
+
+DEFAULT_SIZES = [1000, 10000, 50000, 200000]
+
+class FakeProcess(object):
+    """ Stands for a finished player process in the ProcessList """
+
+    stdout = None
+
+    def poll(self):
+        return 0
+
+    def terminate(self):
+        pass
+
+def make_streams(n, seed=0):
+    rnd = random.Random(seed)
+    hosts = ['twitch.tv', 'youtube.com', 'dailymotion.com', 'example.org']
+    ress  = ['best', 'source', '720p', '480p', 'Medium', 'worst']
+    streams = []
+    for i in range(1, n + 1):
+        name = 'channel{0}'.format(i)
+        streams.append({
+            'id'        : i,
+            'name'      : name,
+            'url'       : 'http://{0}/{1}'.format(rnd.choice(hosts), name),
+            'res'       : rnd.choice(ress),
+            'seen'      : rnd.randint(0, 500),
+            'last_seen' : rnd.randint(0, 1500000000),
+        })
+    return streams
+
+def make_db(path, n, cfg):
+    """ Write a database of n streams, in the storage format of the code being measured """
+    f = shelve.open(path, 'c')
+    f['streams'] = make_streams(n)
+    f.close()
+    l = load_list(path, cfg)
+    l.sync_store()
+    l.store.close()
+
+def git_revision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=dirname(abspath(__file__)), stderr=subprocess.STDOUT)
+        return out.decode().strip()
+    except Exception:
+        return None
+
+def measure(stmt, setup=None, repeat=5, number=1):
+    """ Return the best and mean time of a single call to stmt, in seconds """
+    timer = timeit.Timer(stmt, setup or (lambda: None))
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'best'   : min(times),
+        'mean'   : sum(times) / len(times),
+        'repeat' : repeat,
+        'number' : number,
+    }
+
+def load_list(path, cfg):
+    l = streamlist.StreamList(path, cfg)
+    l._check_stream = lambda url: 1
+    return l
+
+def bench_size(n, repeat, tmpdir, only=None):
+    results = {}
+    def wanted(name):
+        return not only or name in only
+
+    path = join(tmpdir, 'bench-{0}.db'.format(n))
+    make_db(path, n, config)
+
+    if wanted('load'):
+        results['load'] = measure(lambda: load_list(path, config).store.close(), repeat=repeat)
+        try:
+            import tracemalloc
+            tracemalloc.start()
+            l = load_list(path, config)
+            current, peak = tracemalloc.get_traced_memory()
+            results['load']['peak_bytes'] = peak
+            results['load']['retained_bytes'] = current
+            tracemalloc.stop()
+            l.store.close()
+        except ImportError:
+            pass
+
+    l = load_list(path, config)
+    stdscr = headless.Window(50, 200)
+    l.init(stdscr)
+    l.show_streams()
+
+    if wanted('sync_store'):
+        results['sync_store'] = measure(l.sync_store, repeat=repeat)
+
+    def refilter():
+        l.filter = '1'
+        l.refilter_streams()
+        l.filter = ''
+        l.refilter_streams()
+    if wanted('refilter_streams'):
+        results['refilter_streams'] = measure(refilter, repeat=repeat)
+
+    if wanted('init_streams_pad'):
+        results['init_streams_pad'] = measure(l.init_streams_pad, repeat=repeat)
+
+    sample = l.filtered_streams[:1000]
+    def format_lines():
+        for s in sample:
+            l.format_stream_line(s)
+    if wanted('format_stream_line'):
+        results['format_stream_line'] = measure(format_lines, repeat=repeat, number=1)
+        results['format_stream_line']['calls'] = len(sample)
+
+    n_moves = min(1000, n - 1)
+    def moves():
+        for i in range(n_moves):
+            l.move(1)
+        for i in range(n_moves):
+            l.move(-1)
+    if wanted('move'):
+        results['move'] = measure(moves, repeat=repeat)
+        results['move']['calls'] = 2 * n_moves
+
+    ids = [s.id for s in l.streams[::max(1, n // 10)]][:10]
+    def fill_queue():
+        l.q.q = dict((idf, FakeProcess()) for idf in ids)
+    if wanted('check_stopped_streams'):
+        results['check_stopped_streams'] = measure(l.check_stopped_streams, setup=fill_queue, repeat=repeat)
+        results['check_stopped_streams']['players'] = len(ids)
+
+    n_add = 20
+    counter = [0]
+    def add_streams():
+        for i in range(n_add):
+            counter[0] += 1
+            l.add_stream('new{0}'.format(counter[0]), 'http://bench/{0}'.format(counter[0]))
+    if wanted('add_stream'):
+        results['add_stream'] = measure(add_streams, repeat=max(1, repeat // 2))
+        results['add_stream']['calls'] = n_add
+
+    l.store.close()
+    return results
+
+def compare(old, new):
+    """ Print the ratio new/old of the best times for each benchmark """
+    old_sizes = dict((r['size'], r['results']) for r in old['runs'])
+    for run in new['runs']:
+        prev = old_sizes.get(run['size'])
+        if not prev:
+            continue
+        for name, res in sorted(run['results'].items()):
+            if name not in prev:
+                continue
+            ratio = res['best'] / prev[name]['best'] if prev[name]['best'] else float('inf')
+            flag = '  <-- slower' if ratio > 1.1 else ''
+            sys.stdout.write('{0:>8} {1:<24} {2:10.6f}s -> {3:10.6f}s  x{4:.2f}{5}\n'.format(
+                run['size'], name, prev[name]['best'], res['best'], ratio, flag))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark StreamList hot paths.')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated database sizes. default: %(default)s')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per benchmark. default: %(default)s')
+    parser.add_argument('--only', help='comma separated list of benchmarks to run. default: all')
+    parser.add_argument('-o', '--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', metavar='JSON', help='compare with the results of a previous run')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LINES', '50')
+    os.environ.setdefault('COLUMNS', '200')
+    streamlist.curses = headless
+
+    report = {
+        'revision' : git_revision(),
+        'python'   : platform.python_version(),
+        'platform' : platform.platform(),
+        'runs'     : [],
+    }
+    # Never use (or fill) the HTTP cache of the user
+    config.HTTP_CACHE_SIZE = 0
+    tmpdir = tempfile.mkdtemp(prefix='livestreamer-curses-bench-')
+    try:
+        for n in [int(x) for x in args.sizes.split(',')]:
+            sys.stderr.write('benchmarking {0} streams...\n'.format(n))
+            only = args.only and args.only.split(',')
+            report['runs'].append({'size': n, 'results': bench_size(n, args.repeat, tmpdir, only)})
+    finally:
+        shutil.rmtree(tmpdir)
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    elif not args.compare:
+        sys.stdout.write(out + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" Check the worker protocol with several local worker processes
+
+A Coordinator serves a sweep of synthetic URLs to local worker processes
+(livestreamer_curses.workers with --checker pointing at this file, so no
+network or streamlink is needed). One worker checks slowly, so that the
+others steal from it, and is killed in the middle of the sweep, so that
+its leased jobs are requeued. The sweep must still complete every URL.
+
+    python benchmarks/check_workers.py --workers 3 --urls 300
+
+Exits with status 1 if a check is missing or a counter did not move.
+
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from os.path import join, dirname, abspath
+
+benchdir = dirname(abspath(__file__))
+srcdir = join(dirname(benchdir), 'src')
+sys.path.insert(0, srcdir)
+
+from livestreamer_curses import checker
+from livestreamer_curses import metrics
+from livestreamer_curses import workers
+
+DELAY_ENV = 'CHECK_WORKERS_DELAY'
+
+def check(url):
+    """ Worker --checker: pretend to check url, taking $CHECK_WORKERS_DELAY seconds """
+    time.sleep(float(os.environ.get(DELAY_ENV, 0)))
+    return 1, ['best']
+
+def spawn_worker(address, authkey, name, delay, threads):
+    env = dict(os.environ)
+    env[workers.AUTHKEY_ENV] = authkey.decode('ascii')
+    env[DELAY_ENV] = str(delay)
+    env['PYTHONPATH'] = os.pathsep.join([srcdir, benchdir, env.get('PYTHONPATH', '')])
+    cmd = [sys.executable, '-m', 'livestreamer_curses.workers', '{0}:{1}'.format(*address),
+           '--threads', str(threads), '--batch', '8', '--name', name,
+           '--checker', 'check_workers:check']
+    return subprocess.Popen(cmd, env=env)
+
+def counter(m, name):
+    return sum(c.value for labels, c in m.get(name))
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the online check workers against a local coordinator.')
+    parser.add_argument('--workers', type=int, default=3, help='worker processes. default: %(default)s')
+    parser.add_argument('--threads', type=int, default=2, help='connections per worker. default: %(default)s')
+    parser.add_argument('--urls', type=int, default=300, help='URLs in the sweep. default: %(default)s')
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='seconds per check, 20 times more for the worker killed. default: %(default)s')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds before giving up. default: %(default)s')
+    args = parser.parse_args()
+
+    authkey = b'check-workers'
+    m = metrics.Metrics()
+    checks = checker.CheckQueue(None, 0)
+    coordinator = workers.Coordinator(checks, ('127.0.0.1', 0), authkey, metrics=m)
+    coordinator.start()
+
+    urls = ['http://host{0}.invalid/stream{1}'.format(i % 7, i) for i in range(args.urls)]
+    victim = spawn_worker(coordinator.address, authkey, 'victim', args.delay * 20, args.threads)
+    procs = [victim] + [spawn_worker(coordinator.address, authkey, 'worker{0}'.format(i+1), args.delay, args.threads)
+                        for i in range(args.workers - 1)]
+
+    results = {}
+    killed = False
+    deadline = time.time() + args.timeout
+    try:
+        checks.submit((0, i, url) for i, url in enumerate(urls))
+        while len(results) < len(urls) and time.time() < deadline:
+            for url, status, reason in checks.get_results():
+                results[url] = status
+            if not killed and len(results) >= len(urls) // 3:
+                leased = [n for name, n, done in coordinator.workers() if name.startswith('victim/')]
+                if sum(leased):
+                    victim.send_signal(signal.SIGKILL)
+                    victim.wait()
+                    killed = True
+            time.sleep(0.01)
+    finally:
+        checks.stop()
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+                p.wait()
+        coordinator.close()
+
+    stolen = counter(m, 'worker_jobs_stolen_total')
+    requeued = counter(m, 'worker_jobs_requeued_total')
+    missing = [url for url in urls if url not in results]
+    failed = [url for url, status in results.items() if status != 1]
+    print('checked {0}/{1}, failed {2}, stolen {3}, requeued {4}, worker killed: {5}'.format(
+          len(results), len(urls), len(failed), stolen, requeued, killed))
+
+    errors = []
+    if missing:
+        errors.append('{0} URLs never completed, e.g. {1}'.format(len(missing), missing[0]))
+    if failed:
+        errors.append('{0} checks failed, e.g. {1}'.format(len(failed), failed[0]))
+    if not killed:
+        errors.append('the worker was not killed during the sweep, use more --urls')
+    if not stolen:
+        errors.append('no job was stolen')
+    if not requeued:
+        errors.append('no job was requeued')
+    for e in errors:
+        sys.stderr.write('FAIL: {0}\n'.format(e))
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Player stand-in reporting when the first media bytes arrive
+
+Reads the stream from stdin (or from the file given as first argument,
+'-' for stdin) and appends a JSON line to $PLAY_LATENCY_REPORT once
+--bytes bytes have been read, then exits.
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+def main():
+    t_start = time.time()
+    parser = argparse.ArgumentParser(description='Report the time to the first bytes of a stream.')
+    parser.add_argument('input', nargs='?', default='-')
+    parser.add_argument('--bytes', type=int, default=188, help='bytes to read before reporting. default: %(default)s')
+    parser.add_argument('--tag', default='', help='copied to the report')
+    args, _ = parser.parse_known_args()
+
+    if args.input == '-':
+        fd = sys.stdin.fileno()
+    else:
+        fd = os.open(args.input, os.O_RDONLY)
+    n = 0
+    t_first = None
+    while n < args.bytes:
+        data = os.read(fd, args.bytes - n)
+        if not data:
+            break
+        if t_first is None:
+            t_first = time.time()
+        n += len(data)
+
+    report = {
+        'tag'        : args.tag,
+        'pid'        : os.getpid(),
+        'started'    : t_start,
+        'first_byte' : t_first,
+        'full'       : time.time() if n >= args.bytes else None,
+        'bytes'      : n,
+    }
+    path = os.environ.get('PLAY_LATENCY_REPORT')
+    line = json.dumps(report) + '\n'
+    if path:
+        # One write with O_APPEND so that concurrent players do not interleave
+        out = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(out, line.encode('utf-8'))
+        os.close(out)
+    else:
+        sys.stdout.write(line)
+
+if __name__ == '__main__':
+    main()
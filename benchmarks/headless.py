@@ -0,0 +1,128 @@
+""" Headless stand-in for the parts of the curses module used by livestreamer-curses
+
+Windows keep their content in a list of strings so drawing costs are in the
+same ballpark as with a real terminal, minus the terminal I/O itself.
+
+"""
+
+A_NORMAL  = 0
+A_REVERSE = 1 << 18
+A_BOLD    = 1 << 21
+
+KEY_UP   = 259
+KEY_DOWN = 258
+KEY_BACKSPACE = 263
+KEY_ENTER = 343
+
+COLORS = 8
+
+class error(Exception): pass
+
+class Window(object):
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width  = width
+        self.lines  = [''] * height
+        self.y = self.x = 0
+        self.keys = []
+        self.refreshes = 0
+        self.delay = True
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = not flag
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def getyx(self):
+        return self.y, self.x
+
+    def move(self, y, x):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise error('move() returned ERR')
+        self.y, self.x = y, x
+
+    def addstr(self, *args):
+        if len(args) >= 3:
+            y, x, msg = args[:3]
+            self.move(y, x)
+        else:
+            msg = args[0]
+        line = self.lines[self.y]
+        msg = msg[:self.width - self.x]
+        self.lines[self.y] = line[:self.x].ljust(self.x) + msg + line[self.x + len(msg):]
+        self.x = min(self.width - 1, self.x + len(msg))
+
+    def chgat(self, *args):
+        pass
+
+    def clrtoeol(self):
+        self.lines[self.y] = self.lines[self.y][:self.x]
+
+    def clrtobot(self):
+        self.clrtoeol()
+        for i in range(self.y + 1, self.height):
+            self.lines[i] = ''
+
+    def erase(self):
+        self.lines = [''] * self.height
+
+    clear = erase
+
+    def deleteln(self):
+        del self.lines[self.y]
+        self.lines.append('')
+
+    def resize(self, height, width):
+        self.lines = (self.lines + [''] * height)[:height]
+        self.height, self.width = height, width
+        self.y = min(self.y, height - 1)
+        self.x = min(self.x, width - 1)
+
+    def refresh(self, *args):
+        self.refreshes += 1
+
+    def noutrefresh(self, *args):
+        self.refreshes += 1
+
+    def getch(self):
+        if self.keys:
+            return self.keys.pop(0)
+        return -1
+
+    def getstr(self):
+        return b''
+
+def newpad(height, width):
+    return Window(height, width)
+
+def newwin(height, width, y=0, x=0):
+    return Window(height, width)
+
+def doupdate():
+    pass
+
+def resizeterm(height, width):
+    pass
+
+def can_change_color():
+    return False
+
+def use_default_colors():
+    pass
+
+def init_pair(*args):
+    pass
+
+def curs_set(visibility):
+    pass
+
+def echo():
+    pass
+
+def noecho():
+    pass
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" Local HLS stand-in serving synthetic live streams
+
+Every channel name is a live stream with a sliding window playlist, a
+master playlist listing a few variants, and segments made of MPEG-TS null
+packets. Each response is delayed by a fixed latency and sent at a bounded
+bandwidth, to stand for a remote CDN.
+
+    http://127.0.0.1:PORT/live/<channel>/master.m3u8
+    http://127.0.0.1:PORT/live/<channel>/<variant>/index.m3u8
+    http://127.0.0.1:PORT/live/<channel>/<variant>/seg<N>.ts
+
+    python benchmarks/hls_server.py --port 8090 --latency 0.05 --bandwidth 2000000
+
+"""
+
+import argparse
+import socket
+import sys
+import time
+from threading import Thread
+
+if sys.version_info.major >= 3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+# name -> (width, height, bandwidth)
+VARIANTS = {
+        '720p' : (1280, 720, 3000000),
+        '480p' : (852, 480, 1500000),
+        '360p' : (640, 360, 800000),
+}
+
+# Number of segments listed in a live playlist
+WINDOW = 4
+
+TS_PACKET = b'\x47\x1f\xff\x10' + b'\xff' * 184
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class HLSHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.hls
+        time.sleep(server.latency)
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'live' and parts[2] == 'master.m3u8':
+            body = server.master_playlist().encode('ascii')
+            ctype = 'application/vnd.apple.mpegurl'
+        elif len(parts) == 4 and parts[0] == 'live' and parts[2] in VARIANTS and parts[3] == 'index.m3u8':
+            body = server.media_playlist().encode('ascii')
+            ctype = 'application/vnd.apple.mpegurl'
+        elif len(parts) == 4 and parts[0] == 'live' and parts[3].startswith('seg'):
+            body = server.segment
+            ctype = 'video/MP2T'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            server.throttled_write(self.wfile, body)
+        except socket.error:
+            # Players stop reading once they have what they need
+            return
+        server.requests += 1
+
+class HLSServer(object):
+    """ Serve synthetic HLS live streams in a background thread """
+
+    def __init__(self, port=0, latency=0.0, bandwidth=0, segment_duration=2.0, segment_size=256*1024):
+        """ Create a HLSServer
+
+        port             : TCP port on 127.0.0.1, 0 for any free port
+        latency          : delay before each response, in seconds
+        bandwidth        : bytes per second for each response body, 0 for no limit
+        segment_duration : advertised duration of a segment, in seconds
+        segment_size     : size of a segment, in bytes (rounded to TS packets)
+
+        """
+        self.latency   = latency
+        self.bandwidth = bandwidth
+        self.segment_duration = segment_duration
+        self.segment   = TS_PACKET * max(1, segment_size // len(TS_PACKET))
+        self.started   = time.time()
+        self.requests  = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), HLSHandler)
+        self.httpd.hls = self
+        self.port  = self.httpd.server_address[1]
+
+    def url(self, channel, variant=None):
+        if variant:
+            return 'http://127.0.0.1:{0}/live/{1}/{2}/index.m3u8'.format(self.port, channel, variant)
+        return 'http://127.0.0.1:{0}/live/{1}/master.m3u8'.format(self.port, channel)
+
+    def master_playlist(self):
+        lines = ['#EXTM3U']
+        for name, (w, h, bw) in sorted(VARIANTS.items(), key=lambda v: -v[1][2]):
+            lines.append('#EXT-X-STREAM-INF:BANDWIDTH={0},RESOLUTION={1}x{2}'.format(bw, w, h))
+            lines.append('{0}/index.m3u8'.format(name))
+        return '\n'.join(lines) + '\n'
+
+    def media_playlist(self):
+        seq = int((time.time() - self.started) / self.segment_duration)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 '#EXT-X-TARGETDURATION:{0}'.format(int(self.segment_duration + .999)),
+                 '#EXT-X-MEDIA-SEQUENCE:{0}'.format(seq)]
+        for i in range(seq, seq + WINDOW):
+            lines.append('#EXTINF:{0:.3f},'.format(self.segment_duration))
+            lines.append('seg{0}.ts'.format(i))
+        return '\n'.join(lines) + '\n'
+
+    def throttled_write(self, out, body):
+        if not self.bandwidth:
+            out.write(body)
+            return
+        chunk = max(1024, self.bandwidth // 50)
+        t = time.time()
+        for i in range(0, len(body), chunk):
+            out.write(body[i:i+chunk])
+            # Sleep until the bytes sent so far fit in the bandwidth
+            delay = t + float(i + chunk) / self.bandwidth - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        t = Thread(target=self.httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic HLS live streams.')
+    parser.add_argument('--port', type=int, default=8090, help='default: %(default)s')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per request. default: %(default)s')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second, 0 for no limit. default: %(default)s')
+    parser.add_argument('--segment-duration', type=float, default=2.0, help='default: %(default)s')
+    parser.add_argument('--segment-size', type=int, default=256*1024, help='default: %(default)s')
+    args = parser.parse_args()
+    server = HLSServer(args.port, args.latency, args.bandwidth, args.segment_duration, args.segment_size)
+    sys.stderr.write('serving {0}\n'.format(server.url('<channel>')))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
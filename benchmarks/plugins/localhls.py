@@ -0,0 +1,20 @@
+""" Streamlink plugin for the streams of benchmarks/hls_server.py
+
+    localhls://127.0.0.1:PORT/<channel>
+
+Load it with --plugin-dirs benchmarks/plugins (or Streamlink.plugins.load_path).
+"""
+
+import re
+
+from streamlink.plugin import Plugin, pluginmatcher
+from streamlink.stream.hls import HLSStream
+
+@pluginmatcher(re.compile(r'localhls://(?P<host>[^/]+)/(?P<channel>[^/?]+)'))
+class LocalHLS(Plugin):
+
+    def _get_streams(self):
+        url = 'http://{host}/live/{channel}/master.m3u8'.format(**self.match.groupdict())
+        return HLSStream.parse_variant_playlist(self.session, url)
+
+__plugin__ = LocalHLS
@@ -0,0 +1,98 @@
+import sys
+
+if sys.version_info.major >= 3:
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+else:
+    from urlparse import urlsplit, urlunsplit, parse_qsl
+    from urllib import urlencode
+
+# Host prefixes which serve the same content as the bare domain
+HOST_PREFIXES = ('www.', 'm.', 'mobile.')
+
+# Hosts which are other names of a site
+HOST_ALIASES = {
+        'youtu.be'        : 'youtube.com',
+        'go.twitch.tv'    : 'twitch.tv',
+        'player.twitch.tv': 'twitch.tv',
+}
+
+# Query parameters which never change what is played
+TRACKING_PARAMS = set([
+        'ref', 'referrer', 'feature', 'fbclid', 'gclid', 'si',
+        'tt_medium', 'tt_content',
+])
+TRACKING_PREFIXES = ('utm_',)
+
+def _twitch(path, query):
+    # player.twitch.tv/?channel=x and twitch.tv/x are the same channel,
+    # channel names are case insensitive
+    if 'channel' in query and path in ('', '/'):
+        path = '/' + query.pop('channel')
+    parts = path.split('/')
+    if len(parts) > 1:
+        parts[1] = parts[1].lower()
+    return '/'.join(parts), {}
+
+def _youtube(path, query):
+    if path.startswith('/watch'):
+        return '/watch', dict((k, v) for k, v in query.items() if k == 'v')
+    return path, query
+
+def _youtu_be(path, query):
+    # youtu.be/<id> is youtube.com/watch?v=<id>
+    if path.count('/') == 1 and len(path) > 1:
+        return '/watch', {'v': path[1:]}
+    return path, query
+
+# Plugin-level identity of a channel, by host (before resolving aliases):
+# callable(path, query dict) returning the canonical (path, query dict)
+CHANNEL_RULES = {
+        'twitch.tv'   : _twitch,
+        'youtube.com' : _youtube,
+        'youtu.be'    : _youtu_be,
+}
+
+def canonical_url(url):
+    """ Normalised form of a stream URL, identical for URLs playing the same channel
+
+    http becomes https; www./m. host prefixes, default ports, trailing
+    slashes, fragments and tracking parameters are dropped; host aliases
+    are resolved and known sites get their channel identity applied (see
+    CHANNEL_RULES). URLs which cannot be parsed are returned stripped.
+    """
+    url = url.strip()
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').rstrip('.')
+        port = parts.port
+    except ValueError:
+        return url
+    if not host:
+        return url
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') > 1:
+            host = host[len(prefix):]
+            break
+    rule = CHANNEL_RULES.get(host)
+    host = HOST_ALIASES.get(host, host)
+    rule = rule or CHANNEL_RULES.get(host)
+    if port and port not in (80, 443):
+        host = '{0}:{1}'.format(host, port)
+
+    path = parts.path
+    while '//' in path:
+        path = path.replace('//', '/')
+    path = path.rstrip('/')
+    query = dict((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                 if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES))
+
+    if rule:
+        path, query = rule(path, query)
+        path = path.rstrip('/')
+
+    scheme = parts.scheme.lower()
+    if scheme == 'http':
+        scheme = 'https'
+    return urlunsplit((scheme, host, path, urlencode(sorted(query.items())), ''))
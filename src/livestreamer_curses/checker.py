@@ -0,0 +1,336 @@
+from threading import Thread, Condition, Lock, current_thread
+from time import time
+import heapq
+import sys
+
+if sys.version_info.major >= 3:
+    import queue
+    from urllib.parse import urlparse
+else:
+    import Queue as queue
+    from urlparse import urlparse
+
+# Check priorities, lower is checked first
+PRIORITY_VISIBLE  = 0   # rows currently on screen
+PRIORITY_FILTERED = 1   # rows matching the filter, but scrolled away
+PRIORITY_OTHER    = 2   # everything else
+
+# Reasons attached to check results
+RESULT_CHECKED = 'checked'
+RESULT_TIMEOUT = 'timeout'  # the check took longer than the deadline, status is 3
+RESULT_SKIPPED = 'skipped'  # the host circuit breaker is open, status is None
+
+def url_host(url):
+    return urlparse(url).hostname or ''
+
+class CircuitBreaker(object):
+    """ Per-host circuit breaker
+
+    After threshold consecutive failures, checks for a host are skipped
+    for backoff seconds. The first check after that is let through as a
+    probe: if it succeeds the host is closed again, otherwise the backoff
+    doubles, up to max_backoff.
+
+    """
+
+    CLOSED, OPEN, HALF_OPEN = range(3)
+
+    def __init__(self, threshold=3, backoff=30, max_backoff=900):
+        self.threshold   = threshold
+        self.backoff     = backoff
+        self.max_backoff = max_backoff
+        self.hosts = {}     # host -> [state, failures, open_until, backoff, probe]
+        self.lock  = Lock()
+
+    def allow(self, host, now=None, probe=None):
+        """ Whether a check for host may run now
+
+        probe : identifies the check (e.g. its URL) if it is let through as
+                the probe of the host, see release
+        """
+        with self.lock:
+            h = self.hosts.get(host)
+            if h is None or h[0] == self.CLOSED:
+                return True
+            if h[0] == self.HALF_OPEN:
+                # A probe is already running
+                return False
+            if (now or time()) >= h[2]:
+                h[0] = self.HALF_OPEN
+                h[4] = probe
+                return True
+            return False
+
+    def record(self, host, ok, now=None):
+        """ Record the outcome of a check for host """
+        with self.lock:
+            if ok:
+                self.hosts.pop(host, None)
+                return
+            h = self.hosts.setdefault(host, [self.CLOSED, 0, 0, 0, None])
+            h[1] += 1
+            if h[0] == self.HALF_OPEN:
+                h[3] = min(self.max_backoff, 2 * h[3])
+            elif h[0] == self.CLOSED and h[1] >= self.threshold:
+                h[3] = self.backoff
+            else:
+                return
+            h[0] = self.OPEN
+            h[2] = (now or time()) + h[3]
+
+    def release(self, host, probe):
+        """ Give back the probe of a half-open host without an outcome, e.g. when
+        the worker running it is lost, so that the next check probes again
+
+        Does nothing unless probe is the one given to allow for the running probe.
+        """
+        with self.lock:
+            h = self.hosts.get(host)
+            if h is not None and h[0] == self.HALF_OPEN and h[4] == probe:
+                h[0] = self.OPEN
+                h[4] = None
+
+    def retry_in(self, host, now=None):
+        """ Seconds until the next probe of a tripped host, None if it is not tripped """
+        with self.lock:
+            h = self.hosts.get(host)
+            if h is None or h[0] == self.CLOSED:
+                return None
+            return max(0, h[2] - (now or time()))
+
+    def tripped(self, now=None):
+        """ List of (host, seconds until the next probe) for hosts being skipped """
+        with self.lock:
+            hosts = [host for host, h in self.hosts.items() if h[0] != self.CLOSED]
+        return sorted((host, self.retry_in(host, now)) for host in hosts)
+
+class CheckQueue(object):
+    """ Priority queue of online checks, consumed by a pool of worker threads
+
+    Checks are keyed by URL: a URL is checked once however many times it
+    is submitted while pending. Pending checks can be reprioritised (e.g.
+    when the user scrolls) or cancelled. Results are collected with
+    get_results(), on_result is called from the worker thread after each
+    check so that the main loop can be woken up.
+
+    A check running for longer than timeout is reported as failed by
+    expire() and its thread is replaced, so that a hung request does not
+    hold a slot. Checks for hosts tripped in the breaker are skipped.
+
+    Besides the local threads, other consumers (see workers.Coordinator)
+    can lease checks with take() and report them with complete(). A check
+    is owned by whoever took it last: results from anyone else are ignored.
+
+    """
+
+    def __init__(self, check, n_threads, on_result=None, timeout=None, breaker=None):
+        """ Create a CheckQueue
+
+        check     : callable taking a URL and returning an online status
+        n_threads : number of worker threads
+        on_result : optional callable, called without arguments after each check
+        timeout   : optional deadline for a single check, in seconds
+        breaker   : optional CircuitBreaker
+
+        """
+        self.check     = check
+        self.n_threads = n_threads
+        self.on_result = on_result
+        self.timeout   = timeout
+        self.breaker   = breaker
+        self.heap      = []
+        self.entries   = {}     # url -> [priority, order, url, valid]
+        self.running   = {}     # url -> (owner, start time, entry)
+        self.cond      = Condition()
+        self.results   = queue.Queue()
+        self.threads   = []
+        self.stopped   = False
+
+    def start(self):
+        with self.cond:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            while len(self.threads) < self.n_threads:
+                t = Thread(target=self.worker)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.heap = []
+            self.entries = {}
+            self.cond.notify_all()
+
+    def submit(self, checks):
+        """ Queue checks, an iterable of (priority, order, url) """
+        with self.cond:
+            for priority, order, url in checks:
+                if url in self.entries:
+                    continue
+                entry = [priority, order, url, True]
+                self.entries[url] = entry
+                heapq.heappush(self.heap, entry)
+            self.cond.notify_all()
+        self.start()
+
+    def reprioritise(self, priorities):
+        """ Change the priority of pending checks, priorities maps URLs to priorities
+
+        A priority of None cancels the check. URLs which are not pending are ignored.
+        """
+        with self.cond:
+            for url, priority in priorities.items():
+                entry = self.entries.get(url)
+                if entry is None or entry[0] == priority:
+                    continue
+                # Lazy deletion: invalidate the old entry, push a new one
+                entry[3] = False
+                if priority is None:
+                    del self.entries[url]
+                    continue
+                new_entry = [priority, entry[1], url, True]
+                self.entries[url] = new_entry
+                heapq.heappush(self.heap, new_entry)
+            # Drop invalidated entries if they make up most of the heap
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [e for e in self.heap if e[3]]
+                heapq.heapify(self.heap)
+
+    def pending(self):
+        """ Set of URLs waiting to be checked """
+        with self.cond:
+            return set(self.entries)
+
+    def busy(self):
+        with self.cond:
+            return bool(self.entries) or bool(self.running)
+
+    def expire(self, now=None):
+        """ Fail the checks running for longer than the deadline, returns their URLs
+
+        Their threads are abandoned (their result will be ignored) and
+        replaced by new ones.
+        """
+        if not self.timeout:
+            return []
+        now = now or time()
+        with self.cond:
+            expired = [url for url, (owner, start, entry) in self.running.items()
+                       if now - start > self.timeout]
+            for url in expired:
+                owner = self.running.pop(url)[0]
+                if owner in self.threads:
+                    self.threads.remove(owner)
+                self.results.put((url, 3, RESULT_TIMEOUT))
+        for url in expired:
+            if self.breaker:
+                self.breaker.record(url_host(url), False, now)
+        if expired:
+            self.start()
+            if self.on_result:
+                self.on_result()
+        return expired
+
+    def get_results(self):
+        """ Get the (url, status, reason) of the checks completed since the last call """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def take(self, owner, n=1, timeout=None):
+        """ Lease up to n pending checks to owner, highest priority first
+
+        Waits for at most timeout seconds (forever if None) for checks to be
+        queued. Returns the list of URLs to check, None once stopped.
+        Checks of tripped hosts are reported as skipped instead.
+        """
+        urls = []
+        skipped = False
+        with self.cond:
+            if not self.stopped and not self.entries:
+                if timeout is None:
+                    while not self.stopped and not self.entries:
+                        self.cond.wait()
+                else:
+                    self.cond.wait(timeout)
+            if self.stopped:
+                return None
+            t = time()
+            while self.entries and len(urls) < n:
+                entry = heapq.heappop(self.heap)
+                if not entry[3]:
+                    continue
+                url = entry[2]
+                del self.entries[url]
+                if self.breaker and not self.breaker.allow(url_host(url), probe=url):
+                    self.results.put((url, None, RESULT_SKIPPED))
+                    skipped = True
+                    continue
+                self.running[url] = (owner, t, entry)
+                urls.append(url)
+        if skipped and self.on_result:
+            self.on_result()
+        return urls
+
+    def complete(self, owner, url, status):
+        """ Report the result of a leased check, returns False if owner lost it meanwhile """
+        with self.cond:
+            if self.running.get(url, (None,))[0] is not owner:
+                return False
+            # Publish the result before leaving running, so that once
+            # busy() is False every result can be collected
+            self.results.put((url, status, RESULT_CHECKED))
+            del self.running[url]
+        if self.breaker:
+            self.breaker.record(url_host(url), status != 3)
+        if self.on_result:
+            self.on_result()
+        return True
+
+    def requeue(self, owner, urls):
+        """ Give the checks leased to owner back to the queue, e.g. when a worker is lost """
+        n = 0
+        with self.cond:
+            for url in urls:
+                running = self.running.get(url)
+                if running is None or running[0] is not owner:
+                    continue
+                del self.running[url]
+                if self.breaker:
+                    # The check may have been the probe of its host
+                    self.breaker.release(url_host(url), url)
+                if url not in self.entries:
+                    entry = [running[2][0], running[2][1], url, True]
+                    self.entries[url] = entry
+                    heapq.heappush(self.heap, entry)
+                    n += 1
+            self.cond.notify_all()
+        return n
+
+    def reassign(self, url, owner, new_owner):
+        """ Move a leased check from owner to new_owner, returns False if owner did not hold it """
+        with self.cond:
+            running = self.running.get(url)
+            if running is None or running[0] is not owner:
+                return False
+            self.running[url] = (new_owner, time(), running[2])
+            return True
+
+    def worker(self):
+        me = current_thread()
+        while True:
+            urls = self.take(me)
+            if urls is None:
+                return
+            for url in urls:
+                try:
+                    status = self.check(url)
+                except Exception:
+                    status = 3
+                if not self.complete(me, url, status):
+                    # Expired meanwhile, a new thread took our place
+                    return
@@ -7,8 +7,31 @@ DEFAULT_RESOLUTION = 'Medium'
 CHECK_ONLINE_ON_START = False
 CHECK_ONLINE_THREADS = 15
 CHECK_ONLINE_INTERVAL = 0
+CHECK_TIMEOUT = 20
 
-LIVESTREAMER_COMMANDS = ["streamlink"]
+CHECK_WORKERS_ADDRESS = None
+CHECK_WORKERS_AUTHKEY = None
+CHECK_LOCAL_WORKERS = 0
+
+CHECK_BREAKER_THRESHOLD = 3
+CHECK_BREAKER_BACKOFF = 30
+CHECK_BREAKER_MAX_BACKOFF = 900
+
+STREAMLINK_COMMANDS = ["streamlink"]
+
+PLAYER_RESOURCES = {'nice': 5}
+STREAMLINK_RESOURCES = []
+TUI_NICE = 0
+
+RENDER_MAX_FPS = 30
+
+RELAY_PLAYER = None
+RELAY_HTTP_PORT = 0
+RELAY_BUFFER_SIZE = 16 * 1024 * 1024
+RELAY_SLOW_CONSUMERS = 'skip'
+
+METRICS_TEXTFILE = None
+METRICS_WRITE_INTERVAL = 15
 
 RC_DEFAULT_DIR  = (os.environ.get('XDG_CONFIG_HOME') or
                   os.path.expanduser(u'~/.config/livestreamer-curses'))
@@ -16,11 +39,15 @@ RC_DEFAULT_PATH = os.path.join(RC_DEFAULT_DIR, u'livestreamer-cursesrc')
 DB_DEFAULT_DIR  = (os.environ.get('XDG_DATA_HOME') or
                   os.path.expanduser(u'~/.local/share/livestreamer-curses'))
 DB_DEFAULT_PATH = os.path.join(DB_DEFAULT_DIR, u'livestreamer-curses.db')
+RECORDINGS_DIR  = os.path.join(DB_DEFAULT_DIR, u'recordings')
+HTTP_CACHE_DIR  = os.path.join(DB_DEFAULT_DIR, u'http-cache')
+HTTP_CACHE_SIZE = 32 * 1024 * 1024
 
 INDICATORS = [
         '  x  ', # offline
         ' >>> ', # streaming
         '  ?  ', # unknown
         '  !  ', # error
-        '[>>>]'  # playing
+        '[>>>]', # playing
+        '[rec]'  # recording
 ]
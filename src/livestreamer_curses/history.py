@@ -0,0 +1,193 @@
+from array import array
+from time import time, localtime
+
+# Maximum number of samples kept per stream
+MAX_SAMPLES = 1024
+
+# A sample is only recorded when the status changes, or when the previous
+# sample is older than this (in seconds). A status is assumed to hold until
+# the next sample, for at most this long.
+HEARTBEAT = 3600
+
+ENCODING_VERSION = 1
+
+SPARK_LEVELS = ' _.-=+*#'
+
+def _put_varint(out, v):
+    while v >= 0x80:
+        out.append((v & 0x7f) | 0x80)
+        v >>= 7
+    out.append(v)
+
+def _get_varint(data, pos):
+    v = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        v |= (b & 0x7f) << shift
+        if b < 0x80:
+            return v, pos
+        shift += 7
+
+def needs_sample(tail, t, status):
+    """ Whether a check made at time t adds a sample
+
+    tail : last sample as returned by StreamHistory.tail, None if there is none
+    """
+    return tail is None or tail & 3 != status or t - (tail >> 2) >= HEARTBEAT
+
+class StreamHistory(object):
+    """ Bounded, array-backed time series of online check results for one stream
+
+    Only status changes (and a heartbeat sample every HEARTBEAT seconds) are
+    stored, along with the time of the last check. Statuses are the ones
+    used for stream['online']: 0 offline, 1 online, 2 unknown, 3 error.
+
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.times    = array('l')
+        self.statuses = array('B')
+        self.last_checked = 0
+        self.max_samples  = max_samples
+
+    def __len__(self):
+        return len(self.times)
+
+    def tail(self):
+        """ Last sample as a single int, time << 2 | status, None if there is none """
+        if not self.times:
+            return None
+        return int(self.times[-1]) << 2 | self.statuses[-1]
+
+    def add(self, t, status):
+        """ Record the result of a check made at time t, returns True if a sample was added """
+        t = int(t)
+        if t < self.last_checked:
+            return False
+        self.last_checked = t
+        if not needs_sample(self.tail(), t, status):
+            return False
+        self.times.append(t)
+        self.statuses.append(status)
+        extra = len(self.times) - self.max_samples
+        if extra > 0:
+            del self.times[:extra]
+            del self.statuses[:extra]
+        return True
+
+    def encode(self):
+        """ Serialize to a compact bytes string (varint deltas, status in the low 2 bits) """
+        out = bytearray([ENCODING_VERSION])
+        _put_varint(out, len(self.times))
+        prev = int(self.times[0]) if self.times else 0
+        _put_varint(out, prev)
+        for t, status in zip(self.times, self.statuses):
+            t = int(t)
+            _put_varint(out, ((t - prev) << 2) | (status & 3))
+            prev = t
+        _put_varint(out, max(0, self.last_checked - prev))
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data, max_samples=MAX_SAMPLES):
+        h = cls(max_samples)
+        data = bytearray(data)
+        if not data or data[0] != ENCODING_VERSION:
+            return h
+        n, pos = _get_varint(data, 1)
+        t, pos = _get_varint(data, pos)
+        for i in range(n):
+            v, pos = _get_varint(data, pos)
+            t += v >> 2
+            h.times.append(t)
+            h.statuses.append(v & 3)
+        delta, pos = _get_varint(data, pos)
+        h.last_checked = int(t) + delta
+        return h
+
+    def spans(self, since=0, until=None):
+        """ Yield (start, end, status) intervals clipped to [since, until] """
+        if until is None:
+            until = time()
+        n = len(self.times)
+        for i in range(n):
+            start = self.times[i]
+            if i + 1 < n:
+                end = min(self.times[i+1], start + HEARTBEAT)
+            else:
+                end = max(start, self.last_checked)
+            start, end = max(start, since), min(end, until)
+            if end > start:
+                yield start, end, self.statuses[i]
+
+    def uptime(self, since=0, until=None):
+        """ Fraction of the known time in [since, until] the stream was online, None if unknown """
+        online = known = 0
+        for start, end, status in self.spans(since, until):
+            if status in (0, 1):
+                known += end - start
+                if status == 1:
+                    online += end - start
+        if not known:
+            return None
+        return float(online) / known
+
+    def hourly_uptime(self, since=0, until=None):
+        """ Online fraction for each local hour of the day, None for hours without data """
+        online = [0.0] * 24
+        known  = [0.0] * 24
+        for start, end, status in self.spans(since, until):
+            if status not in (0, 1):
+                continue
+            t = start
+            while t < end:
+                # end of the current hour
+                lt = localtime(t)
+                next_t = min(end, t - lt.tm_min*60 - lt.tm_sec - (t % 1) + 3600)
+                known[lt.tm_hour] += next_t - t
+                if status == 1:
+                    online[lt.tm_hour] += next_t - t
+                t = next_t
+        return [o / k if k else None for o, k in zip(online, known)]
+
+    def typical_live_hours(self, since=0, until=None, threshold=.5):
+        """ Hours of the day during which the stream is usually online """
+        return [h for h, u in enumerate(self.hourly_uptime(since, until))
+                if u is not None and u >= threshold]
+
+    def sparkline(self, width, since, until=None):
+        """ ASCII sparkline of the uptime over [since, until], one char per bucket """
+        if until is None:
+            until = time()
+        step = float(until - since) / width
+        online = [0.0] * width
+        known  = [0.0] * width
+        for start, end, status in self.spans(since, until):
+            if status not in (0, 1):
+                continue
+            i = int((start - since) / step)
+            while start < end and i < width:
+                next_t = min(end, since + (i+1)*step)
+                known[i] += next_t - start
+                if status == 1:
+                    online[i] += next_t - start
+                start = next_t
+                i += 1
+        line = []
+        for o, k in zip(online, known):
+            if not k:
+                line.append(' ')
+            else:
+                line.append(SPARK_LEVELS[1 + int(round(o / k * (len(SPARK_LEVELS) - 2)))])
+        return ''.join(line)
+
+def format_hours(hours):
+    """ Format a list of hours as compact ranges, e.g. [1, 2, 3, 20] -> '1-3,20' """
+    ranges = []
+    for h in hours:
+        if ranges and ranges[-1][1] == h - 1:
+            ranges[-1][1] = h
+        else:
+            ranges.append([h, h])
+    return ','.join(str(a) if a == b else '{0}-{1}'.format(a, b) for a, b in ranges)
@@ -0,0 +1,334 @@
+""" On-disk HTTP cache for the requests session of Streamlink
+
+Online checks fetch the same channel pages, API responses and playlists on
+every sweep. CacheAdapter sits in front of the adapter the session already
+uses: fresh responses (max-age, Expires) are served from disk, stale ones
+with an ETag or Last-Modified are revalidated with a conditional request
+and served from disk on 304 Not Modified. Nothing is cached heuristically,
+so a response is never used past what the server allowed.
+
+Only small (MAX_ENTRY_SIZE), complete 200 responses to GET requests are
+stored. Requests made with stream=True, such as stream segments, are not
+cached.
+
+"""
+
+from threading import Lock, current_thread
+from email.utils import parsedate_tz, mktime_tz
+from time import time
+import hashlib
+import json
+import io
+import os
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from . import metrics as metrics_module
+
+# Larger responses are not stored
+MAX_ENTRY_SIZE = 1024 * 1024
+
+# Eviction removes the least recently used entries down to this fraction of the size
+EVICT_TO = 0.9
+
+# Request headers which do not select a different response
+UNKEYED_HEADERS = set(['if-none-match', 'if-modified-since', 'cache-control', 'pragma'])
+
+# Response headers not stored: the body is stored decoded, and cookies are not replayed
+UNSTORED_HEADERS = set(['content-encoding', 'content-length', 'transfer-encoding', 'connection',
+                        'keep-alive', 'set-cookie'])
+
+# Results of a request, as labels of http_cache_requests_total
+HIT         = 'hit'          # fresh, served from disk
+REVALIDATED = 'revalidated'  # stale, served from disk after a 304
+MISS        = 'miss'         # downloaded and stored
+UNCACHEABLE = 'uncacheable'  # downloaded, not storable
+RESULTS = (HIT, REVALIDATED, MISS, UNCACHEABLE)
+
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(','):
+        k, _, v = part.partition('=')
+        k = k.strip().lower()
+        if k:
+            directives[k] = v.strip().strip('"')
+    return directives
+
+def parse_date(value):
+    try:
+        return mktime_tz(parsedate_tz(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def freshness(headers):
+    """ Seconds a response can be used without revalidation, 0 if it must be revalidated """
+    cc = parse_cache_control(headers.get('Cache-Control', ''))
+    if 'no-cache' in cc:
+        return 0
+    if 'max-age' in cc:
+        try:
+            lifetime = int(cc['max-age'])
+        except ValueError:
+            return 0
+    elif 'Expires' in headers:
+        expires = parse_date(headers['Expires'])
+        date = parse_date(headers.get('Date', '')) or time()
+        if expires is None:
+            return 0
+        lifetime = expires - date
+    else:
+        return 0
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return max(0, lifetime - age)
+
+def cache_key(request):
+    """ Key of a request: its method, URL and the headers which may change the response """
+    lines = [request.method, request.url]
+    lines.extend(sorted('{0}: {1}'.format(k.lower(), v) for k, v in request.headers.items()
+                        if k.lower() not in UNKEYED_HEADERS))
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+def format_size(n):
+    for unit in ('B', 'kB', 'MB'):
+        if n < 1024:
+            return '{0:.0f} {1}'.format(n, unit) if unit == 'B' else '{0:.1f} {1}'.format(n, unit)
+        n /= 1024.0
+    return '{0:.1f} GB'.format(n)
+
+class DiskCache(object):
+    """ Entries stored as two files each, evicted by least recent use (their mtime)
+
+    <key>.meta holds the JSON metadata of the response and <key>.body its
+    body, so that a revalidation only rewrites the metadata. Files are
+    written under a temporary name and renamed, so that readers never see
+    a partial file. Safe to use from several threads.
+
+    """
+
+    PARTS = ('meta', 'body')
+
+    def __init__(self, path, max_size):
+        self.path     = path
+        self.max_size = max_size
+        self.size     = 0
+        self.lock     = Lock()
+
+    def scan(self):
+        """ Create the directory if needed and sum the size of the entries """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        size = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.rpartition('.')[2] in self.PARTS:
+                size += os.path.getsize(path)
+            else:
+                # Left over by an interrupted write, or by an older format
+                os.remove(path)
+        with self.lock:
+            self.size = size
+        if size > self.max_size:
+            self.evict()
+
+    def filename(self, key, part):
+        return os.path.join(self.path, '{0}.{1}'.format(key, part))
+
+    def get(self, key):
+        """ (metadata, body) of an entry, None if there is none. Marks it as used. """
+        try:
+            with open(self.filename(key, 'meta'), 'rb') as f:
+                meta = json.loads(f.read().decode('utf-8'))
+            path = self.filename(key, 'body')
+            with open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta, body
+
+    def put(self, key, meta, body):
+        """ Store an entry, replacing the one of key if any """
+        self.write(key, [('body', body), ('meta', json.dumps(meta).encode('utf-8'))])
+
+    def update(self, key, meta):
+        """ Replace the metadata of an entry, keeping its body. Marks it as used. """
+        try:
+            os.utime(self.filename(key, 'body'), None)
+        except OSError:
+            return
+        self.write(key, [('meta', json.dumps(meta).encode('utf-8'))])
+
+    def write(self, key, parts):
+        """ Write (part, data) files of an entry, in order """
+        tmps = []
+        try:
+            for part, data in parts:
+                tmp = '{0}.{1}.tmp'.format(self.filename(key, part), current_thread().ident)
+                tmps.append(tmp)
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+            with self.lock:
+                for (part, data), tmp in zip(parts, tmps):
+                    path = self.filename(key, part)
+                    try:
+                        old = os.path.getsize(path)
+                    except OSError:
+                        old = 0
+                    os.rename(tmp, path)
+                    self.size += len(data) - old
+                evict = self.size > self.max_size
+        except (IOError, OSError):
+            for tmp in tmps:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is under EVICT_TO of its size """
+        with self.lock:
+            entries = {}    # key -> [last use, size]
+            for name in os.listdir(self.path):
+                key, _, part = name.rpartition('.')
+                if part not in self.PARTS:
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                e = entries.setdefault(key, [0, 0])
+                e[0] = max(e[0], st.st_mtime)
+                e[1] += st.st_size
+            size = sum(e[1] for e in entries.values())
+            for mtime, n, key in sorted((e[0], e[1], key) for key, e in entries.items()):
+                if size <= self.max_size * EVICT_TO:
+                    break
+                for part in self.PARTS:
+                    try:
+                        os.remove(self.filename(key, part))
+                    except OSError:
+                        pass
+                size -= n
+            self.size = size
+
+class CacheAdapter(BaseAdapter):
+    """ requests transport adapter caching the responses of another adapter
+
+    Mount it in place of the adapter of a session:
+
+        session.mount('https://', CacheAdapter(session.get_adapter('https://'), cache))
+
+    """
+
+    def __init__(self, upstream, cache, metrics=None):
+        """ Create a CacheAdapter
+
+        upstream : adapter sending the requests which are not served from the cache
+        cache    : DiskCache
+        metrics  : optional metrics.Metrics to count requests and bytes saved in
+
+        """
+        BaseAdapter.__init__(self)
+        self.upstream = upstream
+        self.cache    = cache
+        self.metrics  = metrics or metrics_module.Metrics()
+        self.requests = dict((r, self.metrics.counter('http_cache_requests_total',
+                                 'HTTP requests of the online checks, by cache result', {'result': r}))
+                             for r in RESULTS)
+        self.saved = self.metrics.counter('http_cache_bytes_saved_total',
+                                          'Response bytes served from the HTTP cache')
+
+    def totals(self):
+        """ (requests served from the cache, requests, bytes saved) so far """
+        counts = dict((r, c.value) for r, c in self.requests.items())
+        return counts[HIT] + counts[REVALIDATED], sum(counts.values()), self.saved.value
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET' or stream or 'Range' in request.headers:
+            return self.upstream.send(request, stream=stream, **kwargs)
+        cc = parse_cache_control(request.headers.get('Cache-Control', ''))
+        if 'no-store' in cc or 'no-cache' in cc:
+            return self.upstream.send(request, stream=stream, **kwargs)
+
+        key = cache_key(request)
+        entry = self.cache.get(key)
+        if entry:
+            meta, body = entry
+            if time() < meta['expires']:
+                return self.cached_response(request, meta, body, HIT)
+            if meta.get('etag'):
+                request.headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                request.headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self.upstream.send(request, stream=stream, **kwargs)
+        if entry and response.status_code == 304:
+            headers = CaseInsensitiveDict(meta['headers'])
+            headers.update(self.stored_headers(response.headers))
+            meta['headers'] = dict(headers)
+            meta['expires'] = time() + freshness(headers)
+            meta['etag'] = headers.get('ETag')
+            meta['last_modified'] = headers.get('Last-Modified')
+            response.close()
+            self.cache.update(key, meta)
+            return self.cached_response(request, meta, body, REVALIDATED)
+
+        self.requests[self.store(key, response)].inc()
+        return response
+
+    def store(self, key, response):
+        """ Store a response if it can be reused, returns MISS if it was stored """
+        headers = response.headers
+        cc = parse_cache_control(headers.get('Cache-Control', ''))
+        if (response.status_code != 200 or 'no-store' in cc or 'Set-Cookie' in headers
+                or headers.get('Vary', '').strip() == '*'):
+            return UNCACHEABLE
+        length = headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > MAX_ENTRY_SIZE:
+            return UNCACHEABLE
+        lifetime = freshness(headers)
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if not (lifetime or etag or last_modified):
+            return UNCACHEABLE
+        body = response.content
+        if len(body) > MAX_ENTRY_SIZE:
+            return UNCACHEABLE
+        self.cache.put(key, {
+                'status'        : response.status_code,
+                'reason'        : response.reason,
+                'headers'       : self.stored_headers(headers),
+                'expires'       : time() + lifetime,
+                'etag'          : etag,
+                'last_modified' : last_modified,
+        }, body)
+        return MISS
+
+    def stored_headers(self, headers):
+        return dict((k, v) for k, v in headers.items() if k.lower() not in UNSTORED_HEADERS)
+
+    def cached_response(self, request, meta, body, result):
+        self.requests[result].inc()
+        self.saved.inc(len(body))
+        r = Response()
+        r.status_code = meta['status']
+        r.reason      = meta['reason']
+        r.headers     = CaseInsensitiveDict(meta['headers'])
+        r.encoding    = get_encoding_from_headers(r.headers)
+        r.url         = request.url
+        r.request     = request
+        r.connection  = self
+        r.raw         = io.BytesIO(body)
+        r._content    = body
+        return r
+
+    def close(self):
+        self.upstream.close()
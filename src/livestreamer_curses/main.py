@@ -30,6 +30,7 @@ import imp
 import json
 
 from . import config
+from . import ndjson
 
 from .streamlist import StreamList
 
@@ -47,6 +48,19 @@ def main():
                         default=os.path.join(config.RC_DEFAULT_PATH))
     parser.add_argument('-p', action='store', type=arg_type, metavar='JSON file', help='load (overwrite) database with data from this file. Use - for stdin')
     parser.add_argument('-l', action='store_true', help='print the list of streams and exit')
+    parser.add_argument('-i', action='store', type=arg_type, metavar='NDJSON file',
+                        help='merge streams from this file (one JSON object per line) into the database, '
+                             'matching existing streams by URL. Use - for stdin')
+    parser.add_argument('-e', action='store', type=arg_type, metavar='NDJSON file',
+                        help='export streams to this file (one JSON object per line) and exit. Use - for stdout')
+    parser.add_argument('--fields', type=arg_type, metavar='FIELDS',
+                        default=','.join(ndjson.EXPORT_FIELDS),
+                        help='comma separated list of fields to export with -e. default: %(default)s')
+    parser.add_argument('--filter', type=arg_type, metavar='FILTER', default='',
+                        help='only export streams matching this filter with -e, same syntax as the \'f\' key')
+    parser.add_argument('--merge-duplicates', action='store_true',
+                        help='merge the streams whose URLs point to the same channel (e.g. http://twitch.tv/x '
+                             'and https://www.twitch.tv/x/), keeping the most viewed one, and exit')
     args = parser.parse_args()
 
     rc_filename = args.f
@@ -80,7 +94,36 @@ def main():
             return True
         init_stream_list = list(filter(check_stream, init_stream_list))
 
-    l = StreamList(args.d, config, list_streams=args.l, init_stream_list=init_stream_list)
+    l = StreamList(args.d, config, list_streams=args.l, init_stream_list=init_stream_list,
+                   progressive=not (args.i or args.e or args.merge_duplicates))
+
+    if args.i or args.e or args.merge_duplicates:
+        if args.i:
+            if args.i == '-':
+                buf = sys.stdin
+            else:
+                buf = open(args.i)
+            n_errors = [0]
+            def report(lineno, msg):
+                n_errors[0] += 1
+                sys.stderr.write('{0}:{1}: {2}\n'.format(args.i, lineno, msg))
+            added, updated = l.upsert_streams(ndjson.read_streams(buf, errors=report))
+            sys.stderr.write('{0} streams added, {1} updated, {2} invalid lines skipped\n'.format(
+                added, updated, n_errors[0]))
+        if args.merge_duplicates:
+            merges = l.merge_duplicates()
+            for keep, dups in merges:
+                sys.stderr.write('{0} ({1}) <- {2}\n'.format(keep.url, keep.id,
+                                 ', '.join('{0} ({1})'.format(s.url, s.id) for s in dups)))
+            sys.stderr.write('{0} duplicate streams merged\n'.format(sum(len(d) for k, d in merges)))
+        if args.e:
+            fields = [k.strip() for k in args.fields.split(',') if k.strip()]
+            if args.e == '-':
+                l.export_streams(sys.stdout, fields, args.filter)
+            else:
+                with open(args.e, 'w') as out:
+                    l.export_streams(out, fields, args.filter)
+        return
     if not args.l:
         curses.wrapper(l)
 
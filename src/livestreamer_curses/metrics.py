@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from threading import Lock
+import os
+
+PREFIX = 'livestreamer_curses_'
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+CHECK_BUCKETS   = (.1, .25, .5, 1, 2, 4, 8, 15, 30, 60)
+
+def format_labels(labels):
+    return ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in labels)
+
+class Counter(object):
+    """ Monotonic counter, safe to increment from several threads """
+
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self.lock  = Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class Histogram(object):
+    """ Fixed-bucket histogram, observe() is a bisect and two additions """
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)
+        self.sum     = 0.0
+        self.count   = 0
+        self.lock    = Lock()
+
+    def observe(self, v):
+        i = bisect_left(self.buckets, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum   += v
+            self.count += 1
+
+    def merge(self, other):
+        """ Add the observations of another histogram with the same buckets """
+        with self.lock:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+            self.sum   += other.sum
+            self.count += other.count
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q-quantile """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def samples(self, name, labels):
+        acc = 0
+        for b, c in zip(self.buckets + (float('+inf'),), self.counts):
+            acc += c
+            le = '+Inf' if b == float('+inf') else repr(b)
+            yield name + '_bucket', labels + (('le', le),), acc
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+class Metrics(object):
+    """ Registry of counters and histograms, keyed by name and labels """
+
+    def __init__(self):
+        self.families = {}
+        self.lock     = Lock()
+
+    def _get(self, cls, name, help, labels, *args):
+        labels = tuple(sorted(labels.items())) if labels else ()
+        try:
+            return self.families[name][2][labels]
+        except KeyError:
+            pass
+        with self.lock:
+            family = self.families.setdefault(name, (cls.kind, help, {}))
+            metric = family[2].get(labels)
+            if metric is None:
+                metric = family[2][labels] = cls(*args)
+            return metric
+
+    def counter(self, name, help='', labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def get(self, name):
+        """ Returns a list of (labels dict, metric) for a metric name """
+        family = self.families.get(name)
+        if not family:
+            return []
+        return [(dict(labels), m) for labels, m in sorted(family[2].items())]
+
+    def render(self):
+        """ Render all metrics in the Prometheus text exposition format """
+        lines = []
+        for name, (kind, help, metrics) in sorted(self.families.items()):
+            full_name = PREFIX + name
+            lines.append('# HELP {0} {1}'.format(full_name, help))
+            lines.append('# TYPE {0} {1}'.format(full_name, kind))
+            for labels, m in sorted(metrics.items()):
+                for sample_name, sample_labels, v in m.samples(full_name, labels):
+                    if sample_labels:
+                        lines.append('{0}{{{1}}} {2}'.format(sample_name, format_labels(sample_labels), v))
+                    else:
+                        lines.append('{0} {1}'.format(sample_name, v))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """ Atomically write the metrics for the node_exporter textfile collector """
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp, path)
@@ -0,0 +1,75 @@
+import json
+import sys
+
+try:
+    TEXT_TYPE = unicode
+except NameError:
+    TEXT_TYPE = str
+
+# Fields which must be present (as strings) on every imported line
+REQUIRED_FIELDS = ('name', 'url', 'res')
+# Fields which may be present (as integers) on an imported line
+OPTIONAL_FIELDS = ('id', 'seen', 'last_seen')
+
+EXPORT_FIELDS = ('id', 'name', 'url', 'res', 'seen', 'last_seen')
+
+class ValidationError(Exception): pass
+
+def validate_stream(s):
+    """ Check a decoded line, returns the stream dict or raises ValidationError """
+
+    if not isinstance(s, dict):
+        raise ValidationError('expected a JSON object')
+    for k in REQUIRED_FIELDS:
+        if k not in s:
+            raise ValidationError('missing field "{0}"'.format(k))
+        if not isinstance(s[k], TEXT_TYPE):
+            raise ValidationError('field "{0}" must be a string'.format(k))
+    if not s['url']:
+        raise ValidationError('field "url" must not be empty')
+    for k in OPTIONAL_FIELDS:
+        v = s.get(k)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, int)):
+            raise ValidationError('field "{0}" must be an integer'.format(k))
+        if v is not None and v < 0:
+            raise ValidationError('field "{0}" must not be negative'.format(k))
+    if s.get('id') == 0:
+        raise ValidationError('field "id" must be a positive integer')
+    return dict((k, s[k]) for k in REQUIRED_FIELDS + OPTIONAL_FIELDS if s.get(k) is not None)
+
+def read_streams(buf, errors=None):
+    """ Lazily read streams from a NDJSON file object, one stream per line
+
+    buf    : file object to read from
+    errors : callable(lineno, message) called for every invalid line,
+             defaults to writing to stderr
+
+    Blank lines are skipped. Only one line is held in memory at a time.
+
+    """
+    if errors is None:
+        def errors(lineno, msg):
+            sys.stderr.write('line {0}: {1}\n'.format(lineno, msg))
+
+    for lineno, line in enumerate(buf, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            s = json.loads(line)
+        except ValueError as e:
+            errors(lineno, 'invalid JSON ({0})'.format(e))
+            continue
+        try:
+            yield validate_stream(s)
+        except ValidationError as e:
+            errors(lineno, str(e))
+
+def write_streams(streams, out, fields=EXPORT_FIELDS):
+    """ Write streams to out, one JSON object per line, returns the count """
+    n = 0
+    for s in streams:
+        out.write(json.dumps(dict((k, s[k]) for k in fields if k in s)))
+        out.write('\n')
+        n += 1
+    return n
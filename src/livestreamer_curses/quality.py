@@ -0,0 +1,91 @@
+import re
+
+# Named qualities of older plugins, with the video height they stand for
+NAMED_HEIGHTS = {
+        'mobile' : 160,
+        'low'    : 360,
+        'medium' : 480,
+        'high'   : 720,
+        'ultra'  : 1080,
+}
+
+# Synonyms tried when a quality is not available
+ALIASES = {
+        'source' : 'best',
+        'best'   : 'source',
+}
+
+_VIDEO   = re.compile(r'^(\d+)p(\d+)?')
+_BITRATE = re.compile(r'^(\d+)k$')
+
+# Quality names listed before and after all the others, in this order
+FIRST = ('best', 'source')
+LAST  = ('worst',)
+
+# Catalogs are shared between streams offering the same qualities
+_catalogs = {}
+
+def weight(name):
+    """ Sort key of a quality name, None if it cannot be compared
+
+    Returns ('video', height, fps) or ('bitrate', kbps, 0).
+    """
+    name = name.lower()
+    m = _VIDEO.match(name)
+    if m:
+        return ('video', int(m.group(1)), int(m.group(2) or 0))
+    if name in NAMED_HEIGHTS:
+        return ('video', NAMED_HEIGHTS[name], 0)
+    m = _BITRATE.match(name)
+    if m:
+        return ('bitrate', int(m.group(1)), 0)
+    return None
+
+def rank(name):
+    """ Sort key of a quality name in a catalog: FIRST, then video by height and
+    frame rate, bitrates, other names alphabetically and LAST """
+    lower = name.lower()
+    if lower in FIRST:
+        return (0, FIRST.index(lower), 0, '')
+    if lower in LAST:
+        return (4, LAST.index(lower), 0, '')
+    w = weight(name)
+    if w is None:
+        return (3, 0, 0, lower)
+    kind, value, fps = w
+    return (1 if kind == 'video' else 2, -value, -fps, lower)
+
+def catalog(names):
+    """ Tuple of the quality names, best first, shared with the other streams offering the same """
+    names = sorted(names, key=rank)
+    t = tuple(names)
+    return _catalogs.setdefault(t, t)
+
+def select_quality(wanted, available):
+    """ Quality to play for wanted among available, the nearest one if it is missing
+
+    The nearest quality is the highest one whose resolution (or bitrate) is
+    not above wanted, whatever its frame rate, or the lowest one if they
+    are all above. Falls back to 'best'. When nothing is known about the
+    available qualities, wanted is returned as is.
+    """
+    if not available or wanted in available:
+        return wanted
+    by_lower = dict((a.lower(), a) for a in available)
+    for name in (wanted.lower(), ALIASES.get(wanted.lower())):
+        if name in by_lower:
+            return by_lower[name]
+
+    w = weight(wanted)
+    if w is not None:
+        candidates = [(weight(a), a) for a in available]
+        candidates = [c for c in candidates if c[0] is not None and c[0][0] == w[0]]
+        below = [c for c in candidates if c[0][1] <= w[1]]
+        if below:
+            return max(below)[1]
+        if candidates:
+            return min(candidates)[1]
+
+    if 'best' in available:
+        return 'best'
+    return wanted
@@ -0,0 +1,352 @@
+from threading import Thread, Condition, Lock
+from subprocess import Popen, PIPE
+import socket
+import errno
+import fcntl
+import os
+
+# Size of the reads from the stream
+CHUNK_SIZE = 64 * 1024
+
+# What to do with a consumer which fell behind by more than the buffer size
+SLOW_SKIP = 'skip'  # jump to the live position, losing what was overwritten
+SLOW_DROP = 'drop'  # disconnect it
+
+class RingBuffer(object):
+    """ Fixed-size byte buffer addressed by absolute stream positions
+
+    A single writer appends at position end, readers keep their own
+    position and get memoryview slices of the buffer itself, so that
+    fanning the data out to several consumers does not copy it. Data older
+    than end - size is overwritten: a reader whose position fell behind
+    start() has lost it.
+
+    """
+
+    def __init__(self, size):
+        self.size   = size
+        self.buf    = bytearray(size)
+        self.view   = memoryview(self.buf)
+        self.end    = 0
+        self.closed = False
+        self.cond   = Condition()
+
+    def start(self):
+        """ Oldest position still in the buffer """
+        return max(0, self.end - self.size)
+
+    def write(self, data):
+        n = len(data)
+        if n > self.size:
+            data = data[n-self.size:]
+        with self.cond:
+            pos = self.end % self.size
+            first = min(len(data), self.size - pos)
+            self.buf[pos:pos+first] = data[:first]
+            if first < len(data):
+                self.buf[:len(data)-first] = data[first:]
+            self.end += n
+            self.cond.notify_all()
+
+    def read(self, pos, timeout=None):
+        """ Wait for data after pos, returns a memoryview of it or None on timeout/close
+
+        The view is contiguous, so it may stop at the wrap-around point of
+        the buffer. pos must not be older than start().
+        """
+        with self.cond:
+            if pos >= self.end and not self.closed:
+                self.cond.wait(timeout)
+            if pos >= self.end:
+                return None
+            i = pos % self.size
+            return self.view[i:min(self.size, i + self.end - pos)]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class Consumer(object):
+    """ Reads a relay's ring buffer in its own thread and forwards it somewhere """
+
+    name = 'consumer'
+
+    def __init__(self):
+        self.stopped = False
+        self.sent    = 0
+        self.skipped = 0
+
+    def send(self, view):
+        """ Write (part of) view, returns the number of bytes written """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def run(self, relay):
+        ring = relay.ring
+        # Start from the beginning of the stream as long as the buffer holds
+        # it, from the live position otherwise
+        pos = ring.end if ring.end > ring.size else 0
+        try:
+            while not self.stopped:
+                if pos < ring.start():
+                    if relay.slow_policy == SLOW_DROP:
+                        relay.log('{0} is too slow, dropped'.format(self.name))
+                        return
+                    self.skipped += ring.start() - pos
+                    pos = ring.end
+                view = ring.read(pos, 1)
+                if view is None:
+                    if ring.closed:
+                        return
+                    continue
+                n = self.send(view)
+                # The writer may have overwritten what we were sending, in
+                # which case it counts as lagging behind
+                if pos < ring.start():
+                    continue
+                pos += n
+                self.sent += n
+        except (IOError, OSError, socket.error):
+            pass
+        finally:
+            self.close()
+            relay.consumer_done(self)
+
+class PlayerConsumer(Consumer):
+    """ Feeds a player process reading the stream from its stdin """
+
+    def __init__(self, cmd, policy=None):
+        """ policy : optional resources.ResourcePolicy to spawn cmd with """
+        Consumer.__init__(self)
+        self.name = 'player'
+        spawn = policy.spawn if policy else Popen
+        with open(os.devnull, 'wb') as devnull:
+            self.p = spawn(cmd, stdin=PIPE, stdout=devnull, stderr=devnull)
+        self.fd = self.p.stdin.fileno()
+
+    def send(self, view):
+        return os.write(self.fd, view)
+
+    def close(self):
+        try:
+            self.p.stdin.close()
+            self.p.terminate()
+        except (IOError, OSError):
+            pass
+
+class FileConsumer(Consumer):
+    """ Records the stream to a file """
+
+    def __init__(self, path):
+        Consumer.__init__(self)
+        self.name = 'recording'
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def send(self, view):
+        return os.write(self.fd, view)
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+class SocketConsumer(Consumer):
+    """ Sends the stream to a client of the RelayServer """
+
+    def __init__(self, sock, address):
+        Consumer.__init__(self)
+        self.name = 'http {0}:{1}'.format(*address[:2])
+        self.sock = sock
+
+    def send(self, view):
+        return self.sock.send(view)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+class Relay(object):
+    """ Fetch a stream once and fan it out to several consumers
+
+    Quacks like a Popen object (poll, terminate, stdout) so that it can be
+    kept in a ProcessList: its stdout carries status lines for the main
+    loop. The relay stops when it is terminated or when its last consumer
+    leaves, consumers leave once they have sent everything after the end
+    of the stream.
+
+    """
+
+    def __init__(self, open_stream, buffer_size, slow_policy=SLOW_SKIP):
+        """ Create a Relay
+
+        open_stream : callable returning a file-like object to read the stream from
+        buffer_size : size of the ring buffer shared by the consumers, in bytes
+        slow_policy : SLOW_SKIP or SLOW_DROP, for consumers lagging behind
+
+        """
+        self.open_stream = open_stream
+        self.ring        = RingBuffer(buffer_size)
+        self.slow_policy = slow_policy
+        self.consumers   = []
+        self.lock        = Lock()
+        self.returncode  = None
+        self.exit_code   = 0
+        self.stopped     = False
+        r, self.status_w = os.pipe()
+        fcntl.fcntl(self.status_w, fcntl.F_SETFL,
+                    fcntl.fcntl(self.status_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.stdout = os.fdopen(r, 'r')
+
+    def start(self):
+        t = Thread(target=self.fetch)
+        t.daemon = True
+        t.start()
+
+    def fetch(self):
+        fd = None
+        try:
+            fd = self.open_stream()
+            while not self.stopped:
+                data = fd.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self.ring.write(data)
+        except Exception as e:
+            self.log('Relay error: {0}'.format(e))
+            self.exit_code = 1
+        finally:
+            # Consumers send what is left, then leave
+            self.ring.close()
+            if fd is not None:
+                try:
+                    fd.close()
+                except Exception:
+                    pass
+
+    def add_consumer(self, consumer):
+        with self.lock:
+            if self.returncode is not None:
+                consumer.close()
+                return False
+            self.consumers.append(consumer)
+        t = Thread(target=consumer.run, args=(self,))
+        t.daemon = True
+        t.start()
+        return True
+
+    def remove_consumer(self, consumer):
+        consumer.stopped = True
+
+    def consumer_done(self, consumer):
+        with self.lock:
+            if consumer in self.consumers:
+                self.consumers.remove(consumer)
+            last = not self.consumers
+        if last:
+            self.finish(self.exit_code)
+
+    def find_consumer(self, cls):
+        with self.lock:
+            for c in self.consumers:
+                if isinstance(c, cls) and not c.stopped:
+                    return c
+        return None
+
+    def log(self, msg):
+        """ Send a status line to the main loop, dropped once the relay has finished """
+        with self.lock:
+            if self.status_w is None:
+                return
+            try:
+                os.write(self.status_w, (msg.replace('\n', ' ') + '\n').encode('utf-8'))
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def finish(self, returncode):
+        with self.lock:
+            if self.returncode is not None:
+                return
+            self.returncode = returncode
+            consumers = list(self.consumers)
+            os.close(self.status_w)
+            self.status_w = None
+        self.stopped = True
+        self.ring.close()
+        for c in consumers:
+            c.stopped = True
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.finish(-15)
+
+class RelayServer(object):
+    """ Serve the running relays over HTTP, as http://host:port/<stream id> """
+
+    def __init__(self, port, get_relay, host='127.0.0.1'):
+        """ Create a RelayServer
+
+        port      : TCP port to listen on
+        get_relay : callable taking a stream id and returning its Relay or None
+
+        """
+        self.get_relay = get_relay
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(8)
+
+    def url(self, idf):
+        return 'http://{0}:{1}/{2}'.format(*(self.sock.getsockname()[:2] + (idf,)))
+
+    def start(self):
+        t = Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except socket.error:
+                return
+            t = Thread(target=self.handle, args=(conn, address))
+            t.daemon = True
+            t.start()
+
+    def handle(self, conn, address):
+        try:
+            conn.settimeout(10)
+            request = b''
+            while b'\r\n\r\n' not in request and len(request) < 8192:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                request += data
+            conn.settimeout(None)
+            path = request.split(b' ')[1] if request.count(b' ') >= 2 else b''
+            try:
+                relay = self.get_relay(int(path.strip(b'/')))
+            except ValueError:
+                relay = None
+            if relay is None:
+                conn.sendall(b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                conn.close()
+                return
+            conn.sendall(b'HTTP/1.0 200 OK\r\nContent-Type: video/MP2T\r\n'
+                         b'Cache-Control: no-cache\r\n\r\n')
+            relay.add_consumer(SocketConsumer(conn, address))
+        except socket.error:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
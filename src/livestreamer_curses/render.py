@@ -0,0 +1,73 @@
+from time import time
+
+# Regions drawn on the main screen, as opposed to the current pad
+SCREEN_REGIONS = ('title', 'header', 'footer', 'status', 'screen')
+REGIONS = SCREEN_REGIONS + ('pad',)
+
+class RenderScheduler(object):
+    """ Collect dirty screen regions and flush them at a bounded rate
+
+    Drawing functions only write to the curses windows and mark the
+    regions they touched; flush() then stages the main screen and/or the
+    current pad with noutrefresh and sends everything to the terminal with
+    a single doupdate, at most max_fps times per second.
+
+    """
+
+    def __init__(self, stage_screen, stage_pad, doupdate, max_fps=30, metrics=None):
+        """ Create a RenderScheduler
+
+        stage_screen : callable staging the main screen (noutrefresh)
+        stage_pad    : callable staging the current pad (noutrefresh)
+        doupdate     : callable sending the staged changes to the terminal
+        max_fps      : maximum number of flushes per second, 0 for no limit
+        metrics      : optional metrics.Metrics to count redraws in
+
+        """
+        self.stage_screen = stage_screen
+        self.stage_pad    = stage_pad
+        self.doupdate     = doupdate
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self.last_flush   = 0
+        self.dirty        = set()
+        self.counters     = {}
+        if metrics:
+            for r in REGIONS + ('frame',):
+                self.counters[r] = metrics.counter('redraws_total', 'Number of screen refreshes',
+                                                   {'target': r})
+
+    def mark(self, *regions):
+        """ Mark regions as needing to be sent to the terminal """
+        self.dirty.update(regions)
+
+    def timeout(self):
+        """ Seconds until the next flush is allowed, None if nothing is dirty """
+        if not self.dirty:
+            return None
+        return max(0, self.last_flush + self.min_interval - time())
+
+    def flush(self, force=False):
+        """ Send the dirty regions to the terminal, unless rate limited
+
+        force : (bool) flush even if the last flush was too recent, used
+                before blocking on input or during long operations
+
+        Returns True if something was drawn.
+        """
+        if not self.dirty:
+            return False
+        t = time()
+        if not force and t - self.last_flush < self.min_interval:
+            return False
+        dirty, self.dirty = self.dirty, set()
+        if not dirty.isdisjoint(SCREEN_REGIONS):
+            self.stage_screen()
+        if 'pad' in dirty:
+            self.stage_pad()
+        self.doupdate()
+        self.last_flush = t
+        if self.counters:
+            for r in dirty:
+                self.counters[r].inc()
+            self.counters['frame'].inc()
+        return True
@@ -0,0 +1,201 @@
+""" Resource policies applied to the player processes
+
+A policy is given in the rc file as a dict:
+
+    nice       : niceness added to the one of livestreamer-curses
+    ionice     : I/O scheduling class, 'idle', 'best-effort' or 'realtime',
+                 or a (class, level) tuple. Needs the ionice command.
+    cpus       : CPUs the player may run on, e.g. [2, 3]
+    cgroup     : cgroup v2 directory writable by the user, created if needed,
+                 which all players of the policy join
+    cpu_max    : CPUs the players of the cgroup may use together, e.g. 1.5
+    memory_max : memory the players of the cgroup may use together, in bytes
+                 or with a K, M or G suffix, e.g. '2G'
+
+No Python code runs in the child between fork and exec, which is unsafe
+with the check threads running: the I/O class is set by a command prefix,
+niceness, CPU affinity and the cgroup are applied to the player from
+livestreamer-curses right after it is spawned.
+
+"""
+
+from subprocess import Popen
+import os
+
+IONICE_CLASSES = {
+        'realtime'    : 1,
+        'best-effort' : 2,
+        'idle'        : 3,
+}
+
+# Period of cgroup cpu.max, in microseconds
+CPU_PERIOD = 100000
+
+KEYS = ('nice', 'ionice', 'cpus', 'cgroup', 'cpu_max', 'memory_max')
+
+class ResourceError(Exception): pass
+
+def which(name):
+    """ Path of an executable found in PATH, None if there is none """
+    for d in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(d, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+class ResourcePolicy(object):
+    """ How to spawn a player: niceness, I/O class, CPUs and cgroup """
+
+    def __init__(self, nice=0, ionice=None, cpus=None, cgroup=None, cpu_max=None, memory_max=None):
+        self.nice       = nice
+        self.ionice     = ionice
+        self.cpus       = set(cpus) if cpus else None
+        self.cgroup     = cgroup
+        self.cpu_max    = cpu_max
+        self.memory_max = memory_max
+        self.prefix     = []
+        self.cgroup_fd  = None
+        self.warnings   = []
+
+    @classmethod
+    def from_config(cls, d):
+        """ Build a policy from an rc file dict, None giving an empty policy """
+        d = dict(d or {})
+        unknown = sorted(set(d) - set(KEYS))
+        if unknown:
+            raise ResourceError('unknown resource settings: {0}'.format(', '.join(unknown)))
+        return cls(**d)
+
+    def setup(self):
+        """ Prepare what does not depend on the player, returns the list of warnings
+
+        Settings which cannot be applied here are dropped, the others still
+        apply.
+        """
+        self.warnings = []
+        self.prefix = []
+        if self.nice and not hasattr(os, 'setpriority'):
+            # Python 2: fall back to the nice command
+            path = which('nice')
+            if path:
+                self.prefix = [path, '-n', str(self.nice)]
+            else:
+                self.warnings.append('nice not found, niceness not set')
+            self.nice = 0
+        if self.ionice:
+            try:
+                self.prefix += self.ionice_prefix()
+            except ResourceError as e:
+                self.warnings.append(str(e))
+        if self.cpus and not hasattr(os, 'sched_setaffinity'):
+            self.warnings.append('CPU affinity needs Python 3.3 or later')
+            self.cpus = None
+        if self.cgroup:
+            try:
+                self.cgroup_fd = self.setup_cgroup()
+            except (ResourceError, EnvironmentError) as e:
+                self.warnings.append('cgroup {0}: {1}'.format(self.cgroup, e))
+        elif self.cpu_max or self.memory_max:
+            self.warnings.append('cpu_max and memory_max need a cgroup')
+        return self.warnings
+
+    def ionice_prefix(self):
+        if isinstance(self.ionice, (tuple, list)):
+            name, level = self.ionice
+        else:
+            name, level = self.ionice, None
+        if name not in IONICE_CLASSES:
+            raise ResourceError('unknown ionice class {0!r}'.format(name))
+        path = which('ionice')
+        if not path:
+            raise ResourceError('ionice not found, I/O class not set')
+        prefix = [path, '-c', str(IONICE_CLASSES[name])]
+        if level is not None:
+            prefix.extend(['-n', str(level)])
+        return prefix
+
+    def setup_cgroup(self):
+        """ Create the cgroup, write its limits and open its cgroup.procs """
+        if not os.path.exists(os.path.join(os.path.dirname(self.cgroup), 'cgroup.controllers')):
+            raise ResourceError('parent is not a cgroup v2 directory')
+        if not os.path.isdir(self.cgroup):
+            os.mkdir(self.cgroup)
+        if self.cpu_max:
+            self.write_cgroup('cpu.max', '{0} {1}'.format(int(self.cpu_max * CPU_PERIOD), CPU_PERIOD))
+        if self.memory_max:
+            self.write_cgroup('memory.max', str(self.memory_max))
+        # Opened once here, the pid of each player is written to it
+        return os.open(os.path.join(self.cgroup, 'cgroup.procs'), os.O_WRONLY)
+
+    def write_cgroup(self, name, value):
+        path = os.path.join(self.cgroup, name)
+        if not os.path.exists(path):
+            raise ResourceError('{0} missing, enable its controller in the parent'.format(name))
+        with open(path, 'w') as f:
+            f.write(value)
+
+    def empty(self):
+        return not (self.nice or self.prefix or self.cpus or self.cgroup_fd is not None)
+
+    def wrap(self, cmd):
+        """ Command line with the prefix setting the I/O class, if any """
+        return self.prefix + list(cmd)
+
+    def apply(self, pid):
+        """ Apply niceness, CPU affinity and cgroup to a spawned process
+
+        Errors are ignored (the player still runs), e.g. if it already exited.
+        """
+        if self.nice:
+            try:
+                # Relative to livestreamer-curses, as the player inherited its niceness
+                nice = os.getpriority(os.PRIO_PROCESS, 0) + self.nice
+                os.setpriority(os.PRIO_PROCESS, pid, max(-20, min(19, nice)))
+            except OSError:
+                pass
+        if self.cpus:
+            try:
+                os.sched_setaffinity(pid, self.cpus)
+            except OSError:
+                pass
+        if self.cgroup_fd is not None:
+            try:
+                os.write(self.cgroup_fd, str(pid).encode('ascii'))
+            except OSError:
+                pass
+
+    def spawn(self, cmd, **kwargs):
+        """ Popen cmd under this policy, kwargs are passed on to Popen """
+        if self.empty():
+            return Popen(cmd, **kwargs)
+        p = Popen(self.wrap(cmd), **kwargs)
+        self.apply(p.pid)
+        return p
+
+def command_policies(default, overrides, n):
+    """ Policies of n commands, the dicts of overrides updating default by position
+
+    Returns (default policy, list of n policies, warnings). Commands without
+    an override share the default policy.
+    """
+    warnings = []
+    def build(d):
+        try:
+            policy = ResourcePolicy.from_config(d)
+        except (ResourceError, TypeError) as e:
+            warnings.append(str(e))
+            policy = ResourcePolicy()
+        warnings.extend(policy.setup())
+        return policy
+
+    base = build(default)
+    policies = []
+    for i in range(n):
+        o = overrides[i] if i < len(overrides) else None
+        if o:
+            d = dict(default or {})
+            d.update(o)
+            policies.append(build(d))
+        else:
+            policies.append(base)
+    return base, policies, warnings
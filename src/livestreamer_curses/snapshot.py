@@ -0,0 +1,146 @@
+import mmap
+import os
+import struct
+import sys
+
+from .stream import Stream
+
+PY3 = sys.version_info.major >= 3
+
+MAGIC  = b'LCS2'
+# magic, number of records, generation (see Snapshot.update)
+HEADER = struct.Struct('<4sIQ')
+# id, seen, online, name, res: enough bytes for what the streams pad shows,
+# longer names are truncated by struct. id and seen are signed 64-bit, as
+# Python integers out of that range cannot be stored they fail the update.
+RECORD = struct.Struct('<qqB64s16s')
+# Records compared and rewritten at once by Snapshot.update
+BLOCK = 64
+
+if PY3:
+    def _encode(s):
+        return s.encode('utf-8')
+else:
+    def _encode(s):
+        return s if isinstance(s, str) else s.encode('utf-8')
+
+def _decode(b):
+    # A truncated multibyte character is dropped
+    return b.rstrip(b'\0').decode('utf-8', 'ignore')
+
+class Snapshot(object):
+    """ Memory-mapped copy of the displayed fields of the stream list
+
+    The streams are stored as fixed size records, in the order of the
+    streams pad (by view count), so that the first screen can be drawn
+    without unpickling the whole list. A flush only rewrites the records
+    which changed.
+
+    Each update gets a new generation number, also written to the main
+    store: a snapshot whose generation does not match is stale and must not
+    be used.
+
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self.f     = None
+        self.mm    = None
+        self.count = 0
+        self.generation = 0
+
+    def open(self, generation):
+        """ Map an existing snapshot, returns False if it is missing, corrupt or stale
+
+        generation : expected generation, as read from the main store (None if
+                     the store has none)
+        """
+        self.close()
+        self.generation = generation or 0
+        if generation is None:
+            return False
+        try:
+            f = open(self.path, 'r+b')
+        except (IOError, OSError):
+            return False
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('truncated header')
+            mm = mmap.mmap(f.fileno(), size)
+            magic, count, gen = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or size != HEADER.size + count*RECORD.size or gen != generation:
+                mm.close()
+                raise ValueError('stale or corrupt snapshot')
+        except (ValueError, EnvironmentError, struct.error):
+            f.close()
+            return False
+        self.f, self.mm = f, mm
+        self.count, self.generation = count, gen
+        return True
+
+    def streams(self, start=0, stop=None):
+        """ Streams from the snapshot, with only id, name, res, seen and online set """
+        stop = self.count if stop is None else min(stop, self.count)
+        streams = []
+        for i in range(start, stop):
+            idf, seen, online, name, res = RECORD.unpack_from(self.mm, HEADER.size + i*RECORD.size)
+            streams.append(Stream(idf, _decode(name), '', _decode(res), seen, online=online))
+        return streams
+
+    def online(self):
+        """ Online status of every record, in order, as a bytearray """
+        # The status byte follows id and seen in each record
+        return bytearray(self.mm[HEADER.size+16::RECORD.size])
+
+    def update(self, streams):
+        """ Write streams in order, creating or resizing the file as needed
+
+        Records are compared by blocks of BLOCK, only the blocks which
+        changed are written. Returns the number of records written. The
+        header, with a new generation, is written last. Raises struct.error
+        if a stream cannot be packed, before anything is written.
+        """
+        pack = RECORD.pack
+        data = b''.join([pack(s.id, s.seen, s.online, _encode(s.name), _encode(s.res))
+                         for s in streams])
+        count = len(data) // RECORD.size
+        if self.mm is None or count != self.count:
+            self.resize(count)
+        mm = self.mm
+        written = 0
+        step = BLOCK * RECORD.size
+        for start in range(0, len(data), step):
+            block = data[start:start+step]
+            offset = HEADER.size + start
+            if mm[offset:offset+len(block)] != block:
+                mm[offset:offset+len(block)] = block
+                written += len(block) // RECORD.size
+        if written:
+            mm.flush()
+        self.generation += 1
+        HEADER.pack_into(mm, 0, MAGIC, self.count, self.generation)
+        return written
+
+    def resize(self, count):
+        if self.mm is not None:
+            self.mm.close()
+        if self.f is None:
+            self.f = open(self.path, 'a+b')
+            self.f.close()
+            self.f = open(self.path, 'r+b')
+        size = HEADER.size + count*RECORD.size
+        self.f.truncate(size)
+        self.mm = mmap.mmap(self.f.fileno(), size)
+        # Until the header is written again the snapshot is unusable
+        HEADER.pack_into(self.mm, 0, b'\0' * 4, count, 0)
+        self.count = count
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        self.count = 0
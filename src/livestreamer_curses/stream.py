@@ -0,0 +1,61 @@
+class Stream(object):
+    """ A stream of the list
+
+    Uses __slots__ so that each stream costs a fixed, small amount of memory,
+    and is stored as a plain tuple (see to_tuple) so that pickling the whole
+    list does not pay for per-stream dicts and key strings.
+
+    """
+
+    __slots__ = ('id', 'name', 'url', 'res', 'seen', 'last_seen', 'qualities', 'canonical', 'history_tail',
+                 'online')
+
+    # Persisted fields, in storage order. online is only known at runtime.
+    FIELDS = ('id', 'name', 'url', 'res', 'seen', 'last_seen', 'qualities', 'canonical', 'history_tail')
+    # Fields listed by -l: qualities, canonical and history_tail are derived, not part of the format
+    LIST_FIELDS = ('id', 'name', 'url', 'res', 'seen', 'last_seen', 'online')
+
+    def __init__(self, id, name, url, res, seen=0, last_seen=0, qualities=(), canonical=None,
+                 history_tail=None, online=2):
+        self.id        = id
+        self.name      = name
+        self.url       = url
+        self.res       = res
+        self.seen      = seen
+        self.last_seen = last_seen
+        self.qualities = qualities  # quality names seen on the last successful check
+        self.canonical = canonical  # see canonical.canonical_url, the url itself when identical
+        self.history_tail = history_tail  # last sample of the check history, see history.StreamHistory.tail
+        self.online    = online
+
+    def __repr__(self):
+        return 'Stream({0})'.format(', '.join('{0}={1!r}'.format(k, getattr(self, k))
+                                              for k in self.__slots__))
+
+    def __getstate__(self):
+        return self.to_tuple() + (self.online,)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Build a stream from the former dict format, as used by -p and -i """
+        return cls(d['id'], d['name'], d['url'], d['res'], d.get('seen') or 0,
+                   d.get('last_seen') or 0, tuple(d.get('qualities') or ()), d.get('canonical'),
+                   d.get('history_tail'), d.get('online', 2))
+
+    def to_dict(self, fields=LIST_FIELDS):
+        return dict((k, getattr(self, k)) for k in fields if k in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, t, fields=FIELDS):
+        """ Build a stream from a stored tuple, fields gives the order of its items """
+        if fields == cls.FIELDS:
+            return cls(*t)
+        return cls.from_dict(dict(zip(fields, t)))
+
+    def to_tuple(self):
+        return (self.id, self.name, self.url, self.res, self.seen, self.last_seen, self.qualities,
+                self.canonical, self.history_tail)
@@ -1,29 +1,46 @@
-from time import sleep, time, strftime, localtime
+from time import time, strftime, localtime
+from operator import attrgetter
 import shelve
 import shlex
 from subprocess import STDOUT, Popen, PIPE
 import signal
 import select
 import struct
-from fcntl import ioctl
+import socket
+import fcntl
 import termios
-from multiprocessing.pool import ThreadPool as Pool
 import json
 import sys
 import curses
 import os
+import errno
+from threading import Thread
 
 import streamlink
 
+from . import ndjson
+from . import metrics
+from .history import StreamHistory, format_hours, needs_sample
+from .render import RenderScheduler
+from .stream import Stream
+from . import checker
+from . import relay
+from . import quality
+from . import workers
+from . import resources
+from . import httpcache
+from .canonical import canonical_url
+from .snapshot import Snapshot
+
 PY3 = sys.version_info.major >= 3
 
 if PY3:
-    import queue
+    from urllib.parse import urlparse
 else:
-    import Queue as queue
+    from urlparse import urlparse
 
 PROG_STRING    = 'livestreamer-curses'
-TITLE_STRING   = 'v{{0}} with Livestreamer v{1}'.format(PROG_STRING, livestreamer.__version__)
+TITLE_STRING   = 'v{{0}} with Livestreamer v{1}'.format(PROG_STRING, streamlink.__version__)
 
 ID_FIELD_WIDTH   = 6
 NAME_FIELD_WIDTH = 22
@@ -31,6 +48,32 @@ RES_FIELD_WIDTH  = 12
 VIEWS_FIELD_WIDTH = 7
 PLAYING_FIELD_OFFSET = ID_FIELD_WIDTH + NAME_FIELD_WIDTH + RES_FIELD_WIDTH + VIEWS_FIELD_WIDTH + 6
 
+# Keys moving the cursor, with their direction
+MOVE_KEYS = {
+        curses.KEY_UP   : -1,
+        ord('k')        : -1,
+        curses.KEY_DOWN : 1,
+        ord('j')        : 1
+}
+
+# Seconds without a new SIGWINCH to wait for before actually resizing
+RESIZE_DEBOUNCE = 0.05
+
+# Number of decoded check histories kept in memory between two store flushes
+HISTORY_CACHE_SIZE = 256
+
+# Appended to the database file name for the snapshot of the streams pad
+SNAPSHOT_SUFFIX = '.snap'
+# Rows read from the snapshot while the full stream list loads
+SNAPSHOT_PREVIEW_ROWS = 500
+
+# Keys still handled while the full stream list loads, besides cursor moves
+LOADING_KEYS = set(map(ord, 'gGqhm?')) | set([27])
+
+def stream_matches(stream, filter_string):
+    """ Filter used by the stream list, filter_string must be lowercase """
+    return filter_string in stream.name.lower() or filter_string in stream.url.lower()
+
 class QueueFull(Exception): pass
 class QueueDuplicate(Exception): pass
 class ShelveError(Exception): pass
@@ -46,6 +89,7 @@ class ProcessList(object):
 
         """
         self.q        = {}
+        self.started  = {}
         self.max_size = max_size
         self.call     = f
 
@@ -60,14 +104,18 @@ class ProcessList(object):
         """ Check is the List is full, returns a bool """
         return len(self.q) == 0
 
-    def put(self, stream, cmd):
-        """ Spawn a new background process """
+    def put(self, stream, cmd, call=None, **kwargs):
+        """ Spawn a new background process, with call instead of the default callable if given
+
+        kwargs are passed on to the callable.
+        """
 
         if len(self.q) < self.max_size:
-            if stream['id'] in self.q:
+            if stream.id in self.q:
                 raise QueueDuplicate
-            p = self.call(stream, cmd)
-            self.q[stream['id']] = p
+            p = (call or self.call)(stream, cmd, **kwargs)
+            self.q[stream.id] = p
+            self.started[stream.id] = time()
         else:
             raise QueueFull
 
@@ -80,6 +128,7 @@ class ProcessList(object):
 
         for i in indices:
             self.q.pop(i)
+            self.started.pop(i, None)
         return indices
 
     def get_process(self, idf):
@@ -93,8 +142,16 @@ class ProcessList(object):
             souts.append(v.stdout)
         return souts
 
+    def pop_start_time(self, stdout):
+        """ Get the spawn time of the process writing to stdout, only once per process """
+        for idf, v in self.q.items():
+            if v.stdout is stdout:
+                return self.started.pop(idf, None)
+        return None
+
     def terminate_process(self, idf):
         """ Terminate a process by id """
+        self.started.pop(idf, None)
         try:
             p = self.q.pop(idf)
             p.terminate()
@@ -111,26 +168,42 @@ class ProcessList(object):
                 pass
 
         self.q = {}
+        self.started = {}
+
+def format_command(stream, cmd):
+    """ Replace the {{key}} placeholders of a command line with the stream fields """
+    full_cmd = list(cmd)
+    for k in Stream.__slots__:
+        if k == 'seen':
+            key = 'views'
+        else:
+            key = k
+        value = getattr(stream, k).__str__()
+        full_cmd = [arg.replace('{{'+key+'}}', value) for arg in full_cmd]
+    return full_cmd
 
 class StreamPlayer(object):
     """ Provides a callable to play a given url """
 
-    def play(self, stream, cmd=['streamlink']):
-        full_cmd = list(cmd)
-        for k in stream.keys():
-            for i, arg in enumerate(full_cmd):
-                if k == 'seen':
-                    key = 'views'
-                else:
-                    key = k
-                full_cmd[i] = arg.replace('{{'+key+'}}', stream[k].__str__())
-        full_cmd.extend([stream['url'], stream['res']])
-        return Popen(full_cmd, stdout=PIPE, stderr=STDOUT)
+    def play(self, stream, cmd=['streamlink'], res=None, policy=None):
+        """ Spawn cmd for stream, res overrides the quality of the stream
+
+        policy : optional resources.ResourcePolicy to spawn cmd with
+        """
+        full_cmd = format_command(stream, cmd)
+        full_cmd.extend([stream.url, res or stream.res])
+        spawn = policy.spawn if policy else Popen
+        return spawn(full_cmd, stdout=PIPE, stderr=STDOUT)
 
 class StreamList(object):
 
-    def __init__(self, filename, config, list_streams=False, init_stream_list=None):
-        """ Init and try to load a stream list, nothing about curses yet """
+    def __init__(self, filename, config, list_streams=False, init_stream_list=None, progressive=False):
+        """ Init and try to load a stream list, nothing about curses yet
+
+        progressive : (bool) if a valid snapshot exists, only read the first
+                      rows from it and load the stream list in the background
+                      once the interface is shown (see run)
+        """
 
         global TITLE_STRING
 
@@ -149,30 +222,50 @@ class StreamList(object):
             )
 
         self.max_id = 0
+        self.store = f
+        self.snapshot = Snapshot(filename + SNAPSHOT_SUFFIX)
+        has_snapshot = self.snapshot.open(f.get('snapshot'))
         if init_stream_list:
-            f['streams'] = init_stream_list
-            for i, s in enumerate(f['streams']):
-                s['id'] = s.get('id') or i
-                s['seen'] = s.get('seen') or 0
-                s['last_seen'] = s.get('last_seen') or 0
-            self.max_id = i
+            # The histories belong to the replaced streams, whose ids may be reused
+            for k in list(f.keys()):
+                if k.startswith('history:'):
+                    del f[k]
+            self.streams = [Stream.from_dict(dict(s, id=s.get('id') or i+1, canonical=None, history_tail=None))
+                            for i, s in enumerate(init_stream_list)]
+            self.store_streams()
+            has_snapshot = self.store_snapshot()
             f.sync()
 
-        # Sort streams by view count
+        # Background loading of the stream list, see load_in_background
+        self.loading = None
+        self.loaded = None
         try:
-            self.streams = sorted(f['streams'], key=lambda s:s['seen'], reverse=True)
-            for s in self.streams:
+            if progressive and has_snapshot and not list_streams:
+                self.streams = []
+                self.canonical_index = {}
+                self.loading = Thread(target=self.load_in_background)
+                self.loading.daemon = True
+            else:
+                self.streams = self.read_streams()
                 # Max id, needed when adding a new stream
-                self.max_id = max(self.max_id, s['id'])
-                s['online'] = 2
-            if list_streams:
-                print(json.dumps(self.streams))
-                f.close()
-                sys.exit(0)
+                self.max_id = max([self.max_id] + [s.id for s in self.streams])
+                self.index_canonical()
+                if list_streams:
+                    print(json.dumps([s.to_dict() for s in self.streams]))
+                    f.close()
+                    sys.exit(0)
+        except SystemExit:
+            raise
         except:
             self.streams = []
-        self.db_was_read = True
-        self.filtered_streams = list(self.streams)
+            self.canonical_index = {}
+        # Never write the store before the stream list has been read
+        self.db_was_read = self.loading is None
+        if self.loading:
+            self.filtered_streams = self.snapshot.streams(0, SNAPSHOT_PREVIEW_ROWS)
+        else:
+            self.filtered_streams = list(self.streams)
+        self.index_filtered_streams()
         self.filter = ''
         self.all_streams_offline = None
         self.show_offline_streams = False
@@ -186,24 +279,45 @@ class StreamList(object):
 
         self.last_autocheck = 0
 
+        self.metrics = metrics.Metrics()
+        self.last_metrics_write = 0
+        self.event_loop_histogram = self.metrics.histogram('event_loop_iteration_seconds',
+                'Time spent handling one event loop wakeup')
+
         self.default_res = self.config.DEFAULT_RESOLUTION
 
-        self.store = f
+        # Streams being checked in the background, by checked URL (see check_url)
+        self.check_targets = {}
+        # Quality names found by the check threads, by checked URL
+        self.check_qualities = {}
+
+        # Check histories, loaded lazily from the store
+        self.histories = {}
+        self.dirty_histories = set()
+
         self.store.sync()
 
-        self.no_streams = self.streams == []
+        self.no_streams = not self.filtered_streams
         self.no_stream_shown = self.no_streams
         self.q = ProcessList(StreamPlayer().play)
 
         self.streamlink = streamlink.Streamlink()
+        if self.config.CHECK_TIMEOUT:
+            # Let most stuck requests fail by themselves before the deadline
+            self.streamlink.set_option('http-timeout', self.config.CHECK_TIMEOUT)
+        self.breaker = checker.CircuitBreaker(self.config.CHECK_BREAKER_THRESHOLD,
+                                              self.config.CHECK_BREAKER_BACKOFF,
+                                              self.config.CHECK_BREAKER_MAX_BACKOFF)
 
     def __del__(self):
         """ Stop playing streams and sync storage """
         try:
             self.q.terminate()
             if self.db_was_read:
+                self.sync_histories()
                 self.store['cmd'] = self.cmd
-                self.store['streams'] = self.streams
+                self.store_streams()
+                self.store_snapshot()
                 self.store.close()
         except:
             pass
@@ -228,6 +342,13 @@ class StreamList(object):
         self.s = s
         self.s.keypad(1)
 
+        # Before any thread is started, they inherit the niceness
+        self.setup_resources()
+        self.setup_http_cache()
+
+        self.render = RenderScheduler(self.refresh_screen, self.refresh_current_pad, curses.doupdate,
+                                      self.config.RENDER_MAX_FPS, self.metrics)
+
         self.set_screen_size()
 
         self.pads = {}
@@ -241,12 +362,77 @@ class StreamList(object):
 
         self.got_g = False
 
-        signal.signal(28, self.resize)
+        # Background threads and the SIGWINCH handler only write to these
+        # pipes, the main loop does the work. SIGWINCH has its own so that
+        # the resize debounce never swallows another wakeup.
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.resize_r, self.resize_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w, self.resize_r, self.resize_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.resize_pending = False
+        signal.signal(signal.SIGWINCH, self.on_sigwinch)
+
+        # Online checks run in the background and wake the main loop up
+        self.checks = checker.CheckQueue(self._check_stream, self.config.CHECK_ONLINE_THREADS,
+                                         self.wakeup, self.config.CHECK_TIMEOUT, self.breaker)
+        self.coordinator = None
+        self.local_workers = []
+        if self.config.CHECK_WORKERS_ADDRESS or self.config.CHECK_LOCAL_WORKERS:
+            self.start_workers()
+
+        self.relay_server = None
+        if self.config.RELAY_HTTP_PORT:
+            try:
+                self.relay_server = relay.RelayServer(self.config.RELAY_HTTP_PORT, self.get_relay)
+                self.relay_server.start()
+            except socket.error as e:
+                self.set_status('/!\ Relay server not started: {0}'.format(e))
+                self.render.flush(force=True)
+
+        if self.loading:
+            self.set_status(' Loading {0} streams...'.format(self.snapshot.count))
+            return
 
         if self.config.CHECK_ONLINE_ON_START:
             self.check_online_streams()
 
-        self.set_status('Ready')
+        self.set_status(self.ready_status())
+
+    def setup_resources(self):
+        """ Apply TUI_NICE and prepare the resource policies of the players """
+        self.resource_warnings = []
+        if self.config.TUI_NICE:
+            try:
+                os.nice(self.config.TUI_NICE)
+            except OSError as e:
+                self.resource_warnings.append('TUI_NICE: {0}'.format(e.strerror))
+        self.player_policy, self.cmd_policies, warnings = resources.command_policies(
+                self.config.PLAYER_RESOURCES, self.config.STREAMLINK_RESOURCES, len(self.cmd_list))
+        self.resource_warnings.extend(warnings)
+
+    def setup_http_cache(self):
+        """ Put the on-disk HTTP cache in front of the adapters of the Streamlink session """
+        self.http_cache = None
+        if not self.config.HTTP_CACHE_SIZE:
+            return
+        cache = httpcache.DiskCache(os.path.expanduser(self.config.HTTP_CACHE_DIR),
+                                    self.config.HTTP_CACHE_SIZE)
+        try:
+            cache.scan()
+        except OSError as e:
+            self.resource_warnings.append('HTTP cache disabled: {0}'.format(e.strerror))
+            return
+        session = self.streamlink.http
+        # Both adapters count in the same metrics, either one gives the totals
+        for prefix in ('http://', 'https://'):
+            self.http_cache = httpcache.CacheAdapter(session.get_adapter(prefix), cache, self.metrics)
+            session.mount(prefix, self.http_cache)
+
+    def ready_status(self):
+        """ Status once the stream list can be used, with the resource settings which failed """
+        if self.resource_warnings:
+            return '/!\ {0}'.format('; '.join(self.resource_warnings))
+        return 'Ready'
 
     def getheightwidth(self):
         """ getwidth() -> (int, int)
@@ -257,24 +443,56 @@ class StreamList(object):
             return int(os.environ["LINES"]), int(os.environ["COLUMNS"])
         except KeyError:
             height, width = struct.unpack(
-                "hhhh", ioctl(0, termios.TIOCGWINSZ ,"\000"*8))[0:2]
+                "hhhh", fcntl.ioctl(0, termios.TIOCGWINSZ ,"\000"*8))[0:2]
             if not height:
                 return 25, 80
             return height, width
 
-    def resize(self, signum, obj):
-        """ handler for SIGWINCH """
-        self.s.clear()
+    def on_sigwinch(self, signum, obj):
+        """ handler for SIGWINCH, defers the resize to the main loop """
+        self.resize_pending = True
+        self.wakeup(self.resize_w)
+
+    def wakeup(self, fd=None):
+        """ Interrupt the select() of the main loop, safe from signal handlers and threads """
+        try:
+            os.write(self.wakeup_w if fd is None else fd, b'.')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def drain_wakeup(self, fd=None):
+        try:
+            while os.read(self.wakeup_r if fd is None else fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def wait_resize_settled(self):
+        """ Wait until no SIGWINCH came in for RESIZE_DEBOUNCE seconds """
+        while True:
+            self.drain_wakeup(self.resize_r)
+            try:
+                r = select.select([self.resize_r], [], [], RESIZE_DEBOUNCE)[0]
+            except select.error:
+                continue
+            if not r:
+                return
+
+    def resize(self):
+        """ Apply a terminal size change, reusing the existing pads """
+        self.wait_resize_settled()
+        self.resize_pending = False
+        old_width = self.pad_w
         stream_cursor = self.pads['streams'].getyx()[0]
-        for pad in self.pads.values():
-            pad.clear()
-        self.s.refresh()
+        self.s.clear()
         self.set_screen_size()
         self.set_title(TITLE_STRING)
-        self.init_help()
-        self.init_streams_pad()
+        if self.pad_w != old_width:
+            self.init_help()
+            self.init_streams_pad()
         self.move(stream_cursor, absolute=True, pad_name='streams', refresh=False)
-        self.s.refresh()
         self.show()
 
     def run(self):
@@ -282,95 +500,184 @@ class StreamList(object):
 
         # Show stream list
         self.show_streams()
+        if self.loading:
+            # Draw the snapshot rows before the loader thread competes for the GIL
+            self.render.flush(force=True)
+            self.loading.start()
 
         while True:
-            self.s.refresh()
+            self.render.flush()
 
             # See if any stream has ended
             self.check_stopped_streams()
 
-            # Wait on stdin or on the streams output
+            # Wait on stdin, on the streams output or on a wakeup
             souts = self.q.get_stdouts()
             souts.append(sys.stdin)
+            souts.append(self.wakeup_r)
+            souts.append(self.resize_r)
             try:
-                (r, w, x) = select.select(souts, [], [], 1)
+                timeout = self.render.timeout()
+                (r, w, x) = select.select(souts, [], [], 1 if timeout is None else min(1, timeout))
             except select.error:
                 continue
+            t_iteration = time()
+            self.write_metrics()
+            if self.check_targets:
+                self.checks.expire()
+            if self.loaded is not None:
+                # Not tied to the wakeup of the loader, which may have come with a resize
+                self.finish_loading()
             if not r:
                 if self.config.CHECK_ONLINE_INTERVAL <= 0: continue
                 cur_time = int(time())
                 time_delta = cur_time - self.last_autocheck
-                if time_delta > self.config.CHECK_ONLINE_INTERVAL:
+                if (time_delta > self.config.CHECK_ONLINE_INTERVAL and not self.check_targets
+                        and not self.loading):
                     self.check_online_streams()
-                    self.set_status('Next check at {0}'.format(
-                        strftime('%H:%M:%S', localtime(time() + self.config.CHECK_ONLINE_INTERVAL))
-                        ))
                 continue
+            if self.resize_pending:
+                self.resize()
             for fd in r:
-                if fd != sys.stdin:
+                if fd == self.resize_r:
+                    # Drained by resize()
+                    continue
+                elif fd == self.wakeup_r:
+                    self.drain_wakeup()
+                    self.process_check_results()
+                elif fd != sys.stdin:
                     # Set the new status line only if non-empty
                     msg = fd.readline()
+                    started = self.q.pop_start_time(fd)
+                    if started is not None:
+                        self.metrics.histogram('player_first_output_seconds',
+                                'Time from player spawn to its first line of output',
+                                buckets=metrics.CHECK_BUCKETS).observe(time() - started)
                     if msg:
                         self.set_status(msg[:-1])
                 else:
-                    # Main event loop
-                    c = self.pads[self.current_pad].getch()
-                    if c == curses.KEY_UP or c == ord('k'):
-                        self.move(-1)
-                    elif c == curses.KEY_DOWN or c == ord('j'):
-                        self.move(1)
-                    elif c == ord('f'):
-                        if self.current_pad == 'streams':
-                            self.filter_streams()
-                    elif c == ord('F'):
-                        if self.current_pad == 'streams':
-                            self.clear_filter()
-                    elif c == ord('g'):
-                        if self.got_g:
-                            self.move(0, absolute=True)
-                            self.got_g = False
-                            continue
-                        self.got_g = True
-                    elif c == ord('G'):
-                        self.move(len(self.filtered_streams)-1, absolute=True)
-                    elif c == ord('q'):
-                        if self.current_pad == 'streams':
-                            self.q.terminate()
-                            return
-                        else:
-                            self.show_streams()
-                    elif c == 27: # ESC
-                        if self.current_pad != 'streams':
-                            self.show_streams()
-                    if self.current_pad == 'help':
-                        continue
-                    elif c == 10:
-                        self.play_stream()
-                    elif c == ord('s'):
-                        self.stop_stream()
-                    elif c == ord('c'):
-                        self.reset_stream()
-                    elif c == ord('n'):
-                        self.edit_stream('name')
-                    elif c == ord('r'):
-                        self.edit_stream('res')
-                    elif c == ord('u'):
-                        self.edit_stream('url')
-                    elif c == ord('l'):
-                        self.show_commandline()
-                    elif c == ord('L'):
-                        self.shift_commandline()
-                    elif c == ord('a'):
-                        self.prompt_new_stream()
-                    elif c == ord('d'):
-                        self.delete_stream()
-                    elif c == ord('o'):
-                        self.show_offline_streams ^= True
-                        self.refilter_streams()
-                    elif c == ord('O'):
-                        self.check_online_streams()
-                    elif c == ord('h') or c == ord('?'):
-                        self.show_help()
+                    if not self.handle_keys(self.read_keys()):
+                        return
+            self.event_loop_histogram.observe(time() - t_iteration)
+
+    def read_keys(self):
+        """ Read the pending key presses, as long as they are cursor moves
+
+        Reading stops after the first other key so that keys typed after
+        it (e.g. in a prompt) are left untouched.
+        """
+        pad = self.pads[self.current_pad]
+        keys = [pad.getch()]
+        if keys[0] in MOVE_KEYS:
+            pad.nodelay(1)
+            try:
+                while True:
+                    c = pad.getch()
+                    if c == -1:
+                        break
+                    keys.append(c)
+                    if c not in MOVE_KEYS:
+                        break
+            finally:
+                pad.nodelay(0)
+        return keys
+
+    def handle_keys(self, keys):
+        """ Handle key presses, consecutive cursor moves are applied as one
+
+        Returns False if the user asked to quit.
+        """
+        delta = 0
+        for c in keys:
+            if c in MOVE_KEYS:
+                delta += MOVE_KEYS[c]
+                continue
+            if delta:
+                self.move_by(delta)
+                delta = 0
+            if not self.handle_key(c):
+                return False
+        if delta:
+            self.move_by(delta)
+        return True
+
+    def handle_key(self, c):
+        """ Handle a single key press, returns False if the user asked to quit """
+        if self.loading and c not in LOADING_KEYS:
+            self.set_status(' Still loading {0} streams...'.format(self.snapshot.count))
+            return True
+        if c == ord('f'):
+            if self.current_pad == 'streams':
+                self.filter_streams()
+        elif c == ord('F'):
+            if self.current_pad == 'streams':
+                self.clear_filter()
+        elif c == ord('g'):
+            if self.got_g:
+                self.move(0, absolute=True)
+                self.got_g = False
+            else:
+                self.got_g = True
+        elif c == ord('G'):
+            self.move(len(self.filtered_streams)-1, absolute=True)
+        elif c == ord('q'):
+            if self.current_pad == 'streams':
+                self.q.terminate()
+                self.checks.stop()
+                self.stop_workers()
+                return False
+            else:
+                self.show_streams()
+        elif c == 27: # ESC
+            if self.current_pad != 'streams':
+                self.show_streams()
+        if self.current_pad in ['help', 'stats']:
+            return True
+        elif c == 10:
+            self.play_stream()
+        elif c == ord('s'):
+            self.stop_stream()
+        elif c == ord('c'):
+            self.reset_stream()
+        elif c == ord('n'):
+            self.edit_stream('name')
+        elif c == ord('r'):
+            self.edit_stream('res')
+        elif c == ord('u'):
+            self.edit_stream('url')
+        elif c == ord('l'):
+            self.show_commandline()
+        elif c == ord('L'):
+            self.shift_commandline()
+        elif c == ord('a'):
+            self.prompt_new_stream()
+        elif c == ord('d'):
+            self.delete_stream()
+        elif c == ord('R'):
+            self.record_stream()
+        elif c == ord('o'):
+            self.show_offline_streams ^= True
+            self.refilter_streams()
+        elif c == ord('O'):
+            self.check_online_streams()
+        elif c == ord('h') or c == ord('?'):
+            self.show_help()
+        elif c == ord('m'):
+            self.show_stats()
+        return True
+
+    def move_by(self, delta):
+        """ Move the cursor (or scroll) by delta lines at once """
+        if self.current_pad == 'streams':
+            if self.no_stream_shown:
+                return
+            row = self.pads['streams'].getyx()[0]
+            target = max(0, min(len(self.filtered_streams)-1, row + delta))
+            if target != row:
+                self.move(target, absolute=True)
+        else:
+            for i in range(abs(delta)):
+                self.move(1 if delta > 0 else -1)
 
     def set_screen_size(self):
         """ Setup screen size and padding
@@ -394,11 +701,13 @@ class StreamList(object):
         """ Set first header line text """
         self.s.move(0, 0)
         self.overwrite_line(msg, curses.A_REVERSE)
+        self.render.mark('title')
 
     def set_header(self, msg):
         """ Set second head line text """
         self.s.move(1, 0)
         self.overwrite_line(msg, attr=curses.A_NORMAL)
+        self.render.mark('header')
 
     def set_footer(self, msg, reverse=True):
         """ Set first footer line text """
@@ -407,15 +716,22 @@ class StreamList(object):
             self.overwrite_line(msg, attr=curses.A_REVERSE)
         else:
             self.overwrite_line(msg, attr=curses.A_NORMAL)
+        self.render.mark('footer')
 
     def clear_footer(self):
         self.s.move(self.max_y-1, 0)
         self.overwrite_line('')
+        self.render.mark('footer')
 
     def init_help(self):
-        help_pad_length = 27    # there should be a neater way to do this
-        h = curses.newpad(help_pad_length, self.pad_w)
-        h.keypad(1)
+        help_pad_length = 28    # there should be a neater way to do this
+        h = self.pads.get('help')
+        if h:
+            h.resize(help_pad_length, self.pad_w)
+            h.erase()
+        else:
+            h = curses.newpad(help_pad_length, self.pad_w)
+            h.keypad(1)
 
         h.addstr( 0, 0, 'STREAM MANAGEMENT', curses.A_BOLD)
         h.addstr( 2, 0, '  Enter : start stream')
@@ -426,6 +742,7 @@ class StreamList(object):
         h.addstr( 7, 0, '  c     : reset stream view count')
         h.addstr( 8, 0, '  a     : add stream')
         h.addstr( 9, 0, '  d     : delete stream')
+        h.addstr(10, 0, '  R     : start/stop recording stream')
 
         h.addstr(11, 0, '  l     : show command line')
         h.addstr(12, 0, '  L     : cycle command line')
@@ -439,8 +756,9 @@ class StreamList(object):
         h.addstr(22, 0, '  O     : check for online streams')
         h.addstr(23, 0, '  gg    : go to top')
         h.addstr(24, 0, '  G     : go to bottom')
-        h.addstr(25, 0, '  h/?   : show this help')
-        h.addstr(26, 0, '  q     : quit')
+        h.addstr(25, 0, '  m     : show statistics')
+        h.addstr(26, 0, '  h/?   : show this help')
+        h.addstr(27, 0, '  q     : quit')
 
         self.pads['help'] = h
         self.offsets['help'] = 0
@@ -448,7 +766,8 @@ class StreamList(object):
     def show(self):
         funcs = {
             'streams' : self.show_streams,
-            'help'    : self.show_help
+            'help'    : self.show_help,
+            'stats'   : self.show_stats
         }
         funcs[self.current_pad]()
 
@@ -458,15 +777,117 @@ class StreamList(object):
         self.s.clrtobot()
         self.set_header('Help'.center(self.pad_w))
         self.set_footer(' ESC or \'q\' to return to main menu')
-        self.s.refresh()
+        self.render.mark('screen')
         self.current_pad = 'help'
-        self.refresh_current_pad()
+        self.render.mark('pad')
+
+    def stats_lines(self):
+        """ Summarize the metrics as a list of (text, attr) lines """
+        def hist_line(label, h, unit=1000, suffix='ms'):
+            return '  {0:<28} n={1:<7} mean={2:>8.1f}{4}  p90<={3:>8.1f}{4}'.format(
+                    label[:28], h.count, h.mean()*unit, h.quantile(.9)*unit, suffix)
+
+        lines = [('EVENT LOOP', curses.A_BOLD), ('', curses.A_NORMAL)]
+        lines.append((hist_line('iteration', self.event_loop_histogram), curses.A_NORMAL))
+        for labels, c in self.metrics.get('redraws_total'):
+            lines.append(('  {0:<28} {1}'.format('redraws ({0})'.format(labels['target']), c.value),
+                          curses.A_NORMAL))
+        for name, title in [('store_flush_seconds', 'store flush'),
+                            ('player_first_output_seconds', 'player first output')]:
+            for labels, h in self.metrics.get(name):
+                lines.append((hist_line(title, h), curses.A_NORMAL))
+
+        checks = self.metrics.get('check_duration_seconds')
+        errors = dict((tuple(sorted(l.items())), c.value) for l, c in self.metrics.get('check_errors_total'))
+        for key, title in [('plugin', 'CHECKS BY PLUGIN'), ('host', 'CHECKS BY HOST')]:
+            lines.extend([('', curses.A_NORMAL), (title, curses.A_BOLD), ('', curses.A_NORMAL)])
+            merged = {}
+            for labels, h in checks:
+                m = merged.setdefault(labels[key], [metrics.Histogram(h.buckets), 0])
+                m[0].merge(h)
+                m[1] += errors.get(tuple(sorted(labels.items())), 0)
+            for label, (h, n_errors) in sorted(merged.items()):
+                lines.append(('{0}  errors={1:.0%}'.format(hist_line(label, h, 1, 's'),
+                              float(n_errors)/h.count if h.count else 0), curses.A_NORMAL))
+
+        timeouts = dict((l['host'], c.value) for l, c in self.metrics.get('check_timeouts_total'))
+        skipped = dict((l['host'], c.value) for l, c in self.metrics.get('check_skipped_total'))
+        lines.extend([('', curses.A_NORMAL), ('TRIPPED HOSTS', curses.A_BOLD), ('', curses.A_NORMAL)])
+        tripped = self.breaker.tripped()
+        for host, retry_in in tripped:
+            lines.append(('  {0:<28} retry in {1:>4.0f}s  timeouts={2:<5} skipped={3}'.format(
+                          host[:28], retry_in, timeouts.get(host, 0), skipped.get(host, 0)),
+                          curses.A_NORMAL))
+        if not tripped:
+            lines.append(('  none', curses.A_NORMAL))
+
+        if self.http_cache:
+            lines.extend([('', curses.A_NORMAL), ('HTTP CACHE', curses.A_BOLD), ('', curses.A_NORMAL)])
+            cached, total, saved = self.http_cache.totals()
+            for labels, c in self.metrics.get('http_cache_requests_total'):
+                lines.append(('  {0:<28} {1}'.format(labels['result'], c.value), curses.A_NORMAL))
+            lines.append(('  {0:<28} {1:.0%}'.format('hit rate', float(cached) / total if total else 0),
+                          curses.A_NORMAL))
+            lines.append(('  {0:<28} {1}'.format('bytes saved', httpcache.format_size(saved)),
+                          curses.A_NORMAL))
+            lines.append(('  {0:<28} {1} / {2}'.format('size', httpcache.format_size(self.http_cache.cache.size),
+                          httpcache.format_size(self.http_cache.cache.max_size)), curses.A_NORMAL))
+
+        if self.coordinator:
+            lines.extend([('', curses.A_NORMAL), ('WORKERS', curses.A_BOLD), ('', curses.A_NORMAL)])
+            for name, leased, done in sorted(self.coordinator.workers()):
+                lines.append(('  {0:<28} leased={1:<5} done={2}'.format(name[:28], leased, done),
+                              curses.A_NORMAL))
+            for name in ('worker_jobs_stolen_total', 'worker_jobs_requeued_total'):
+                for labels, c in self.metrics.get(name):
+                    lines.append(('  {0:<28} {1}'.format(name[len('worker_jobs_'):-len('_total')], c.value),
+                                  curses.A_NORMAL))
+        return lines
+
+    def init_stats(self):
+        lines = self.stats_lines()
+        h = curses.newpad(len(lines), self.pad_w)
+        h.keypad(1)
+        for y, (text, attr) in enumerate(lines):
+            h.addstr(y, 0, text[:self.pad_w-1], attr)
+        self.pads['stats'] = h
+        self.offsets['stats'] = 0
+
+    def show_stats(self):
+        """ Redraw the statistics screen and wait for any input to leave """
+        self.init_stats()
+        self.s.move(1,0)
+        self.s.clrtobot()
+        self.set_header('Statistics'.center(self.pad_w))
+        self.set_footer(' ESC or \'q\' to return to main menu')
+        self.render.mark('screen')
+        self.current_pad = 'stats'
+        self.render.mark('pad')
+
+    def write_metrics(self):
+        """ Periodically dump the metrics to METRICS_TEXTFILE, if set """
+        path = self.config.METRICS_TEXTFILE
+        if not path:
+            return
+        t = time()
+        if t - self.last_metrics_write < self.config.METRICS_WRITE_INTERVAL:
+            return
+        self.last_metrics_write = t
+        try:
+            self.metrics.write_textfile(path)
+        except (IOError, OSError) as e:
+            self.set_status(' Failed to write metrics: {0}'.format(e))
 
     def init_streams_pad(self, start_row=0):
-        """ Create a curses pad and populate it with a line by stream """
+        """ Populate the streams pad with a line by stream, creating it if needed """
         y = 0
-        pad = curses.newpad(max(1,len(self.filtered_streams)), self.pad_w)
-        pad.keypad(1)
+        pad = self.pads.get('streams')
+        if pad:
+            pad.resize(max(1,len(self.filtered_streams)), self.pad_w)
+            pad.erase()
+        else:
+            pad = curses.newpad(max(1,len(self.filtered_streams)), self.pad_w)
+            pad.keypad(1)
         for s in self.filtered_streams:
             pad.addstr(y, 0, self.format_stream_line(s))
             y+=1
@@ -505,18 +926,25 @@ class StreamList(object):
             self.set_header('{0} {1} {2} {3}  Status'.format(idf, name, res, views))
             self.redraw_stream_footer()
             self.redraw_status()
-        self.s.refresh()
+        self.render.mark('screen')
         if not self.no_stream_shown:
-            self.refresh_current_pad()
+            self.render.mark('pad')
 
     def hide_streams_pad(self):
         pad = self.pads.get('streams')
         if pad:
-            pad.refresh(0, 0, 2, 0, 2, 0)
+            pad.noutrefresh(0, 0, 2, 0, 2, 0)
+
+    def refresh_screen(self):
+        """ Stage the main screen, only called by the render scheduler """
+        self.s.noutrefresh()
 
     def refresh_current_pad(self):
+        """ Stage the current pad, only called by the render scheduler """
+        if self.current_pad == 'streams' and self.no_stream_shown:
+            return
         pad = self.pads[self.current_pad]
-        pad.refresh(self.offsets[self.current_pad], 0, 2, self.pad_x, self.pad_h, self.pad_w)
+        pad.noutrefresh(self.offsets[self.current_pad], 0, 2, self.pad_x, self.pad_h, self.pad_w)
 
     def move(self, direction, absolute=False, pad_name=None, refresh=True):
         """ Scroll the current pad
@@ -534,7 +962,7 @@ class StreamList(object):
         # pads in this list will be moved screen-wise as opposed to line-wise
         # if absolute is set, will go all the way top or all the way down depending
         # on direction
-        scroll_only = [ 'help' ]
+        scroll_only = [ 'help', 'stats' ]
 
         if not pad_name:
             pad_name = self.current_pad
@@ -581,21 +1009,43 @@ class StreamList(object):
             pad.chgat(curses.A_REVERSE)
         if pad_name == 'streams':
             self.redraw_stream_footer()
+            self.reprioritise_checks()
         if refresh:
-            self.refresh_current_pad()
+            self.render.mark('pad')
 
     def format_stream_line(self, stream):
-        idf = '{0} '.format(stream['id']).rjust(ID_FIELD_WIDTH)
-        name = ' {0}'.format(stream['name'][:NAME_FIELD_WIDTH-2]).ljust(NAME_FIELD_WIDTH)
-        res  = ' {0}'.format(stream['res'][:RES_FIELD_WIDTH-2]).ljust(RES_FIELD_WIDTH)
-        views  = '{0} '.format(stream['seen']).rjust(VIEWS_FIELD_WIDTH)
-        p = self.q.get_process(stream['id']) != None
-        if p:
+        idf = '{0} '.format(stream.id).rjust(ID_FIELD_WIDTH)
+        name = ' {0}'.format(stream.name[:NAME_FIELD_WIDTH-2]).ljust(NAME_FIELD_WIDTH)
+        res  = ' {0}'.format(stream.res[:RES_FIELD_WIDTH-2]).ljust(RES_FIELD_WIDTH)
+        views  = '{0} '.format(stream.seen).rjust(VIEWS_FIELD_WIDTH)
+        p = self.q.get_process(stream.id)
+        if isinstance(p, relay.Relay) and p.find_consumer(relay.FileConsumer) and len(self.config.INDICATORS) > 5:
+            indicator = self.config.INDICATORS[5] # recording
+        elif p is not None:
             indicator = self.config.INDICATORS[4] # playing
         else:
-            indicator = self.config.INDICATORS[stream['online']]
+            indicator = self.config.INDICATORS[stream.online]
         return '{0} {1} {2} {3}   {4}'.format(idf, name, res, views, indicator)
 
+    def redraw_stream(self, stream):
+        """ Redraw the line of a stream, if it is shown """
+        row = self.filtered_rows.get(stream.id)
+        if row is None or self.no_stream_shown:
+            return
+        pad = self.pads['streams']
+        cursor = pad.getyx()[0]
+        if row == cursor:
+            attr = curses.A_REVERSE
+        else:
+            attr = curses.A_NORMAL
+        pad.move(row, 0)
+        pad.clrtoeol()
+        pad.addstr(row, 0, self.format_stream_line(stream), attr)
+        pad.move(row, 0)
+        pad.chgat(attr)
+        pad.move(cursor, 0)
+        self.render.mark('pad')
+
     def redraw_current_line(self):
         """ Redraw the highlighted line """
         if self.no_streams:
@@ -608,7 +1058,7 @@ class StreamList(object):
         pad.addstr(row, 0, self.format_stream_line(s), curses.A_REVERSE)
         pad.chgat(curses.A_REVERSE)
         pad.move(row, 0)
-        self.refresh_current_pad()
+        self.render.mark('pad')
 
     def set_status(self, status):
         self.status = status
@@ -617,77 +1067,260 @@ class StreamList(object):
     def redraw_status(self):
         self.s.move(self.max_y, 0)
         self.overwrite_line(self.status[:self.max_x], curses.A_NORMAL)
-        self.s.refresh()
+        self.render.mark('status')
 
     def redraw_stream_footer(self):
-        if not self.no_stream_shown:
+        if self.loading and not self.no_stream_shown:
+            row = self.pads[self.current_pad].getyx()[0]
+            self.set_footer('{0}/{1} loading...'.format(row+1, self.snapshot.count))
+        elif not self.no_stream_shown:
             row = self.pads[self.current_pad].getyx()[0]
             s = self.filtered_streams[row]
-            self.set_footer('{0}/{1} {2} {3}'.format(row+1, len(self.filtered_streams), s['url'], s['res']))
-            self.s.refresh()
+            footer = '{0}/{1} {2} {3}'.format(row+1, len(self.filtered_streams), s.url, s.res)
+            retry_in = self.breaker.retry_in(checker.url_host(s.url))
+            if retry_in is not None:
+                footer += ' [host down, retry in {0:.0f}s]'.format(retry_in)
+            history = self.format_history(s)
+            if history:
+                width = self.max_x - len(history) - 1
+                footer = footer[:width].ljust(width) + ' ' + history
+            self.set_footer(footer)
+
+    def format_history(self, stream, days=7, width=28):
+        """ Summary of the check history of a stream for the footer, '' if there is none """
+        h = self.get_history(stream)
+        if not len(h):
+            return ''
+        now = time()
+        since = now - days*24*3600
+        uptime = h.uptime(since, now)
+        if uptime is None:
+            return ''
+        hours = format_hours(h.typical_live_hours(since, now))
+        return '{0}d [{1}] {2:.0%} up{3}'.format(days, h.sparkline(width, since, now), uptime,
+                                                 ', live {0}h'.format(hours) if hours else '')
 
     def check_stopped_streams(self):
         finished = self.q.get_finished()
-        for f in finished:
-            for s in self.streams:
-                try:
-                    i = self.filtered_streams.index(s)
-                except ValueError:
-                    continue
-                if f == s['id']:
-                    self.set_footer('Stream {0} has stopped'.format(s['name']))
-                    if i == self.pads[self.current_pad].getyx()[0]:
-                        attr = curses.A_REVERSE
-                    else:
-                        attr = curses.A_NORMAL
-                    self.pads['streams'].addstr(i, PLAYING_FIELD_OFFSET,
-                                                self.config.INDICATORS[s['online']], attr)
-                    self.refresh_current_pad()
+        if not finished:
+            return
+        for i, s in enumerate(self.filtered_streams):
+            if s.id in finished:
+                self.set_footer('Stream {0} has stopped'.format(s.name))
+                if i == self.pads[self.current_pad].getyx()[0]:
+                    attr = curses.A_REVERSE
+                else:
+                    attr = curses.A_NORMAL
+                self.pads['streams'].addstr(i, PLAYING_FIELD_OFFSET,
+                                            self.config.INDICATORS[s.online], attr)
+                self.render.mark('pad')
 
     def _check_stream(self, url):
+        t = time()
+        plugin = None
         try:
             plugin = self.streamlink.resolve_url(url)
             avail_streams = plugin.get_streams()
             if avail_streams:
-                return 1
-            return 0
+                status = 1
+                self.check_qualities[url] = quality.catalog(avail_streams)
+            else:
+                status = 0
         except:
-            return 3
+            status = 3
+        if plugin is None:
+            plugin_name = 'none'
+        else:
+            plugin_name = getattr(plugin, 'module', None) or type(plugin).__name__.lower()
+        labels = {
+                'plugin' : plugin_name,
+                'host'   : urlparse(url).hostname or 'unknown'
+                }
+        self.metrics.histogram('check_duration_seconds', 'Online check latency',
+                               labels, metrics.CHECK_BUCKETS).observe(time() - t)
+        if status == 3:
+            self.metrics.counter('check_errors_total', 'Online checks which failed', labels).inc()
+        return status
+
+    def start_workers(self):
+        """ Serve the checks to worker processes, spawning CHECK_LOCAL_WORKERS of them """
+        address = self.config.CHECK_WORKERS_ADDRESS
+        authkey = self.config.CHECK_WORKERS_AUTHKEY
+        if address and not authkey:
+            self.set_status('/!\ CHECK_WORKERS_AUTHKEY must be set to accept workers')
+            return
+        if not address:
+            # Local workers only
+            address = ('127.0.0.1', 0)
+            authkey = ''.join('{0:02x}'.format(b) for b in bytearray(os.urandom(16)))
+        try:
+            self.coordinator = workers.Coordinator(self.checks, address, authkey.encode('ascii'),
+                                                   self.on_worker_result, metrics=self.metrics)
+        except (IOError, OSError) as e:
+            self.set_status('/!\ Check workers not started: {0}'.format(e))
+            return
+        self.coordinator.start()
+        self.local_workers = workers.spawn_local_workers(self.config.CHECK_LOCAL_WORKERS,
+                                                         self.coordinator.address, authkey)
+
+    def stop_workers(self):
+        for p in self.local_workers:
+            try:
+                p.terminate()
+            except OSError:
+                pass
+        self.local_workers = []
+        if self.coordinator:
+            self.coordinator.close()
+            self.coordinator = None
+
+    def on_worker_result(self, url, status, qualities):
+        """ Called from the coordinator threads, like _check_stream from the local ones """
+        if qualities:
+            self.check_qualities[url] = quality.catalog(qualities)
+
+    def visible_urls(self):
+        """ URLs of the streams currently on screen """
+        offset = self.offsets.get('streams', 0)
+        return set(self.check_url(s) for s in self.filtered_streams[offset:offset+self.pad_h])
+
+    def check_url(self, stream):
+        """ URL checked for a stream: the one of the stream indexed for its canonical URL
+
+        The canonical URL itself is not checked, it may not be served (e.g.
+        https for an http-only host).
+        """
+        return self.canonical_index.get(stream.canonical, stream).url
 
     def check_online_streams(self):
+        """ Start checking all streams in the background
+
+        Streams on screen are checked first, then the ones matching the
+        filter, then the others. Streams sharing a canonical URL are checked
+        once. Results are applied by process_check_results.
+        """
+        if self.check_targets:
+            self.set_status(' Already checking online streams...')
+            return
         self.all_streams_offline = True
+        self.check_targets = {}
+        for s in self.streams:
+            self.check_targets.setdefault(self.check_url(s), []).append(s)
+        self.check_done = 0
+        self.check_skipped = set()
+        self.check_visible = self.visible_urls()
+        self.check_cache_start = self.http_cache.totals() if self.http_cache else None
+
+        checks = []
+        for i, s in enumerate(self.filtered_streams):
+            url = self.check_url(s)
+            if url in self.check_visible:
+                checks.append((checker.PRIORITY_VISIBLE, i, url))
+            else:
+                checks.append((checker.PRIORITY_FILTERED, i, url))
+        n = len(checks)
+        for i, s in enumerate(self.streams):
+            checks.append((checker.PRIORITY_OTHER, n+i, self.check_url(s)))
+        self.checks.submit(checks)
         self.set_status(' Checking online streams...')
 
-        done_queue   = queue.Queue()
-
-        def check_stream_managed(args):
-            url, queue = args
-            status = self._check_stream(url)
-            done_queue.put(url)
-            return status
-
-        pool = Pool(self.config.CHECK_ONLINE_THREADS)
-        args = [(s['url'], done_queue) for s in self.streams]
-        statuses = pool.map_async(check_stream_managed, args)
-        n_streams = len(self.streams)
-
-        while not statuses.ready():
-            sleep(0.1)
-            self.set_status(' Checked {0}/{1} streams...'.format(done_queue.qsize(), n_streams))
-            self.s.refresh()
-
-        statuses = statuses.get()
-        for i, s in enumerate(self.streams):
-            s['online'] = statuses[i]
-            if s['online']:
-                self.all_streams_offline = False
+    def reprioritise_checks(self, filter_changed=False):
+        """ Move the pending checks of the streams on screen to the front of the queue """
+        if not self.check_targets:
+            return
+        visible = self.visible_urls()
+        if filter_changed:
+            filtered = set(self.check_url(s) for s in self.filtered_streams)
+            priorities = {}
+            for url in self.checks.pending():
+                if url in visible:
+                    priorities[url] = checker.PRIORITY_VISIBLE
+                elif url in filtered:
+                    priorities[url] = checker.PRIORITY_FILTERED
+                else:
+                    priorities[url] = checker.PRIORITY_OTHER
+        else:
+            if visible == self.check_visible:
+                return
+            priorities = dict((url, checker.PRIORITY_FILTERED) for url in self.check_visible - visible)
+            priorities.update((url, checker.PRIORITY_VISIBLE) for url in visible)
+        self.check_visible = visible
+        self.checks.reprioritise(priorities)
+
+    def cancel_check(self, stream):
+        """ Drop a deleted stream from the sweep, cancelling its check if no other stream shares it """
+        url = self.check_url(stream)
+        if stream not in self.check_targets.get(url, []):
+            # The canonical index changed since the sweep started
+            url = next((u for u, targets in self.check_targets.items() if stream in targets), None)
+            if url is None:
+                return
+        targets = self.check_targets[url]
+        targets.remove(stream)
+        if not targets:
+            self.checks.reprioritise({url: None})
+
+    def process_check_results(self):
+        """ Apply the results of the background checks, finish the sweep once all are in """
+        if not self.check_targets:
+            return
+        done = not self.checks.busy()
+        t = time()
+        for url, status, reason in self.checks.get_results():
+            self.check_done += 1
+            if reason != checker.RESULT_CHECKED:
+                host = urlparse(url).hostname or 'unknown'
+                if reason == checker.RESULT_SKIPPED:
+                    # The host is tripped, keep what we knew about the stream
+                    self.check_skipped.add(url)
+                    self.metrics.counter('check_skipped_total', 'Online checks skipped by the circuit breaker',
+                                         {'host': host}).inc()
+                    continue
+                self.metrics.counter('check_timeouts_total', 'Online checks which hit CHECK_TIMEOUT',
+                                     {'host': host}).inc()
+            qualities = self.check_qualities.pop(url, None)
+            for s in self.check_targets.get(url, []):
+                s.online = status
+                if qualities:
+                    s.qualities = qualities
+                self.record_check(s, t)
+                self.redraw_stream(s)
+                if s.online:
+                    self.all_streams_offline = False
+        if not done:
+            self.set_status(' Checked {0}/{1} streams...'.format(self.check_done, len(self.check_targets)))
+            return
 
+        self.check_targets = {}
+        if self.dirty_histories:
+            # The stream records hold the last sample of each history
+            self.sync_store()
+        else:
+            self.sync_histories()
         self.refilter_streams()
         self.last_autocheck = int(time())
-
-        pool.close()
-
-    def prompt_input(self, prompt=''):
+        summary = ''
+        if self.check_skipped:
+            hosts = set(checker.url_host(url) for url in self.check_skipped)
+            summary = ' Skipped {0} streams on {1} tripped hosts ({2}).'.format(
+                    len(self.check_skipped), len(hosts), ', '.join(sorted(hosts)))
+        if self.check_cache_start:
+            cached, total, saved = [b - a for a, b in zip(self.check_cache_start, self.http_cache.totals())]
+            if total:
+                summary += ' HTTP cache: {0:.0%} hits, {1} saved.'.format(
+                        float(cached) / total, httpcache.format_size(saved))
+        if self.config.CHECK_ONLINE_INTERVAL > 0:
+            self.set_status('Next check at {0}.{1}'.format(
+                strftime('%H:%M:%S', localtime(time() + self.config.CHECK_ONLINE_INTERVAL)),
+                summary))
+        elif summary:
+            self.set_status(summary)
+
+    def prompt_input(self, prompt='', completions=None):
+        """ Read a line on the status line, completions is an optional list of values cycled with Tab """
+        if completions:
+            return self.prompt_completion(prompt, completions)
+        self.render.flush(force=True)
         self.s.move(self.max_y, 0)
         self.s.clrtoeol()
         self.s.addstr(prompt)
@@ -700,7 +1333,42 @@ class StreamList(object):
         self.s.clrtoeol()
         return r
 
+    def prompt_completion(self, prompt, completions):
+        self.set_footer(' Tab: {0}'.format(' '.join(completions)))
+        self.render.flush(force=True)
+        curses.curs_set(1)
+        text = ''
+        matches = None
+        while True:
+            self.s.move(self.max_y, 0)
+            self.s.clrtoeol()
+            self.s.addstr((prompt + text)[-self.max_x:])
+            c = self.s.getch()
+            if c in (10, 13, curses.KEY_ENTER):
+                break
+            elif c == 27: # ESC
+                text = ''
+                break
+            elif c == 9: # Tab
+                if matches is None:
+                    matches = [m for m in completions if m.lower().startswith(text.lower())]
+                    i = -1
+                if matches:
+                    i = (i + 1) % len(matches)
+                    text = matches[i]
+                continue
+            elif c in (curses.KEY_BACKSPACE, 127, 8):
+                text = text[:-1]
+            elif 32 <= c < 127:
+                text += chr(c)
+            matches = None
+        curses.curs_set(0)
+        self.s.move(self.max_y, 0)
+        self.s.clrtoeol()
+        return text
+
     def prompt_confirmation(self, prompt='', def_yes=False):
+        self.render.flush(force=True)
         self.s.move(self.max_y-1, 0)
         self.s.clrtoeol()
         if def_yes:
@@ -722,23 +1390,259 @@ class StreamList(object):
         else:
             return def_yes
 
+    def get_history(self, stream):
+        """ Check history of a stream, loaded from the store on first use """
+        idf = stream.id
+        h = self.histories.get(idf)
+        if h is None:
+            try:
+                h = StreamHistory.decode(self.store['history:{0}'.format(idf)])
+            except KeyError:
+                h = StreamHistory()
+            self.histories[idf] = h
+        return h
+
+    def record_check(self, stream, t=None):
+        """ Append the current online status of a stream to its history
+
+        A history is only written back when a sample was added: the time of
+        the last check alone is not persisted. The last sample is also kept
+        in the stream record, so that a check which adds none does not need
+        to load the history.
+        """
+        idf = stream.id
+        t = int(t or time())
+        tail = stream.history_tail
+        if idf not in self.histories and tail is not None and not needs_sample(tail, t, stream.online):
+            return
+        h = self.get_history(stream)
+        if h.add(t, stream.online):
+            self.dirty_histories.add(idf)
+        stream.history_tail = h.tail()
+
+    def delete_history(self, stream):
+        self.histories.pop(stream.id, None)
+        self.dirty_histories.discard(stream.id)
+        stream.history_tail = None
+        try:
+            del self.store['history:{0}'.format(stream.id)]
+        except KeyError:
+            pass
+
+    def sync_histories(self):
+        """ Write modified histories to the store and drop them from memory """
+        for idf in self.dirty_histories:
+            h = self.histories.get(idf)
+            if h is not None:
+                self.store['history:{0}'.format(idf)] = h.encode()
+        self.dirty_histories = set()
+        if len(self.histories) > HISTORY_CACHE_SIZE:
+            self.histories = {}
+
+    def read_streams(self):
+        """ Read the stream list from the store, sorted by view count
+
+        Streams get the online status they had when the snapshot was written,
+        a snapshot matching the store lists them in the same order.
+        """
+        streams = self.load_streams()
+        streams.sort(key=attrgetter('seen'), reverse=True)
+        if self.snapshot.count == len(streams):
+            for s, online in zip(streams, self.snapshot.online()):
+                s.online = online
+        return streams
+
+    def load_in_background(self):
+        """ Loader thread, hands the stream list over to the main loop (see finish_loading) """
+        try:
+            streams = self.read_streams()
+        except Exception:
+            streams = []
+        self.loaded = streams
+        self.wakeup()
+
+    def finish_loading(self):
+        """ Replace the snapshot rows with the loaded streams, keeping the cursor in place """
+        self.streams, self.loaded, self.loading = self.loaded, None, None
+        self.max_id = max([self.max_id] + [s.id for s in self.streams])
+        self.index_canonical()
+        self.db_was_read = True
+        self.no_streams = self.streams == []
+        self.no_stream_shown = self.no_streams
+        self.filtered_streams = list(self.streams)
+        self.index_filtered_streams()
+        # The snapshot is in the same order, rows only differ if it was stale
+        row = min(self.pads['streams'].getyx()[0], max(0, len(self.filtered_streams)-1))
+        offset = min(self.offsets['streams'], row)
+        self.init_streams_pad(row)
+        self.offsets['streams'] = offset
+        if self.current_pad == 'streams':
+            self.show_streams()
+        self.set_status(self.ready_status())
+        if self.config.CHECK_ONLINE_ON_START:
+            self.check_online_streams()
+
+    def load_streams(self):
+        """ Read the stream list from the store
+
+        Streams are stored as tuples under 'records', along with the order of
+        their fields. Databases from older versions store a list of dicts
+        under 'streams' instead.
+        """
+        try:
+            fields, rows = self.store['records']
+        except KeyError:
+            return [Stream.from_dict(d) for d in self.store.get('streams', [])]
+        fields = tuple(fields)
+        return [Stream.from_tuple(t, fields) for t in rows]
+
+    def store_streams(self):
+        self.store['records'] = (Stream.FIELDS, [s.to_tuple() for s in self.streams])
+        if 'streams' in self.store:
+            del self.store['streams']
+
+    def store_snapshot(self):
+        """ Rewrite the changed rows of the snapshot, returns False on failure """
+        try:
+            self.snapshot.update(sorted(self.streams, key=attrgetter('seen'), reverse=True))
+        except (EnvironmentError, ValueError, OverflowError, struct.error):
+            # A partly written snapshot must not match the store
+            self.store['snapshot'] = None
+            return False
+        self.store['snapshot'] = self.snapshot.generation
+        return True
+
     def sync_store(self):
-        self.store['streams'] = self.streams
+        t = time()
+        self.sync_histories()
+        self.store_streams()
+        self.store_snapshot()
         self.store.sync()
+        self.metrics.histogram('store_flush_seconds',
+                'Time to write the stream list to disk').observe(time() - t)
+
+    def upsert_streams(self, new_streams):
+        """ Merge streams into the list, matching existing ones by URL
+
+        new_streams : iterable of stream dicts (as read by ndjson.read_streams),
+                      consumed lazily
+
+        Existing streams get their name and resolution updated but keep their
+        id, view count and last seen date. URLs are compared in their
+        canonical form. Returns (added, updated) counts.
+
+        """
+        ids = set(s.id for s in self.streams)
+        added = updated = 0
+        for ns in new_streams:
+            s = self.canonical_index.get(canonical_url(ns['url']))
+            if s:
+                s.name = ns['name']
+                s.res  = ns['res']
+                updated += 1
+                continue
+            idf = ns.get('id')
+            if not idf or idf in ids:
+                self.max_id += 1
+                idf = self.max_id
+            else:
+                self.max_id = max(self.max_id, idf)
+            s = Stream(idf, ns['name'], ns['url'], ns['res'],
+                       ns.get('seen', 0), ns.get('last_seen', 0))
+            self.streams.append(s)
+            self.index_stream(s)
+            ids.add(idf)
+            added += 1
+        self.no_streams = self.streams == []
+        self.sync_store()
+        return added, updated
+
+    def export_streams(self, out, fields=ndjson.EXPORT_FIELDS, filter_string=''):
+        """ Write streams matching filter_string to out as NDJSON, returns the count """
+        filter_string = filter_string.lower()
+        return ndjson.write_streams(
+                (s.to_dict(fields) for s in self.streams if stream_matches(s, filter_string)),
+                out, fields)
 
     def bump_stream(self, stream, throttle=False):
         t = int(time())
 
         # only bump if stream was last started some time ago
-        if throttle and  t - stream['last_seen'] < 60*1:
+        if throttle and  t - stream.last_seen < 60*1:
             return
-        stream['seen'] += 1
-        stream['last_seen'] = t
+        stream.seen += 1
+        stream.last_seen = t
         self.sync_store()
 
+    def index_canonical(self):
+        """ Build the index of the streams by canonical URL, computing the missing ones
+
+        The index holds one stream per canonical URL, the first one in
+        self.streams, which is enough to find duplicates.
+        """
+        self.canonical_index = {}
+        for s in self.streams:
+            if s.canonical is None:
+                self.set_canonical(s)
+            self.canonical_index.setdefault(s.canonical, s)
+
+    def set_canonical(self, stream):
+        canonical = canonical_url(stream.url)
+        # Share the string when nothing changed, it costs nothing more per stream
+        stream.canonical = stream.url if canonical == stream.url else canonical
+
+    def index_stream(self, stream):
+        """ Add a stream to the canonical index, returns the stream it duplicates if any """
+        self.set_canonical(stream)
+        dup = self.canonical_index.setdefault(stream.canonical, stream)
+        if dup is not stream:
+            return dup
+        return None
+
+    def unindex_stream(self, stream):
+        if self.canonical_index.get(stream.canonical) is not stream:
+            return
+        del self.canonical_index[stream.canonical]
+        # A duplicate left over from an older database takes its place
+        for s in self.streams:
+            if s is not stream and s.canonical == stream.canonical:
+                self.canonical_index[s.canonical] = s
+                break
+
+    def merge_duplicates(self):
+        """ Merge the streams sharing a canonical URL, returns a list of (kept, merged streams)
+
+        The most viewed stream of each group is kept, with the views of the
+        others added to it. The check histories of the others are dropped.
+        """
+        groups = {}
+        for s in self.streams:
+            groups.setdefault(s.canonical, []).append(s)
+        merges = []
+        for canonical, streams in groups.items():
+            if len(streams) < 2:
+                continue
+            streams = sorted(streams, key=lambda s: (-s.seen, s.id))
+            keep, dups = streams[0], streams[1:]
+            for s in dups:
+                keep.seen += s.seen
+                keep.last_seen = max(keep.last_seen, s.last_seen)
+                if not keep.qualities:
+                    keep.qualities = s.qualities
+                self.delete_history(s)
+            self.canonical_index[canonical] = keep
+            merges.append((keep, dups))
+        if merges:
+            merged = set(id(s) for keep, dups in merges for s in dups)
+            self.streams = [s for s in self.streams if id(s) not in merged]
+            self.filtered_streams = [s for s in self.filtered_streams if id(s) not in merged]
+            self.index_filtered_streams()
+            self.sync_store()
+        return merges
+
     def find_stream(self, sel, key='id'):
         for s in self.streams:
-            if s[key] == sel:
+            if getattr(s, key) == sel:
                 return s
         return None
 
@@ -753,11 +1657,12 @@ class StreamList(object):
     def refilter_streams(self, quiet=False):
         self.filtered_streams = []
         for s in self.streams:
-            if ((self.show_offline_streams or s['online'] in [1,2])
-                and (self.filter in s['name'].lower() or self.filter in s['url'].lower())):
+            if ((self.show_offline_streams or s.online in [1,2])
+                and stream_matches(s, self.filter)):
                 self.filtered_streams.append(s)
-        self.filtered_streams.sort(key=lambda s:s['seen'], reverse=True)
+        self.filtered_streams.sort(key=attrgetter('seen'), reverse=True)
         self.no_stream_shown = len(self.filtered_streams) == 0
+        self.index_filtered_streams()
         if not quiet:
             self.status = ' Filter: {0} ({1}/{2} matches, {3} showing offline streams)'.format(
                     self.filter or '<empty>', len(self.filtered_streams), len(self.streams),
@@ -766,9 +1671,15 @@ class StreamList(object):
         self.redraw_stream_footer()
         self.show_streams()
         self.redraw_status()
+        self.reprioritise_checks(filter_changed=True)
+
+    def index_filtered_streams(self):
+        """ Map stream ids to their row in the streams pad """
+        self.filtered_rows = dict((s.id, i) for i, s in enumerate(self.filtered_streams))
 
     def add_stream(self, name, url, res=None, bump=False):
-        ex_stream = self.find_stream(url, key='url')
+        canonical = canonical_url(url)
+        ex_stream = self.canonical_index.get(canonical)
         if ex_stream:
             if bump:
                 self.bump_stream(ex_stream)
@@ -800,19 +1711,14 @@ class StreamList(object):
                 actual_res = DEFAULT_RESOLUTION_HARD
 
             self.set_status(' Checking if new stream is online...')
-            self.s.refresh()
+            self.render.flush(force=True)
             online = self._check_stream(url)
 
-            new_stream = {
-                    'id'        : idf,
-                    'name'      : name,
-                    'seen'      : seen,
-                    'last_seen' : last_seen,
-                    'res'       : actual_res,
-                    'url'       : url,
-                    'online'    : online
-                }
+            new_stream = Stream(idf, name, url, actual_res, seen, last_seen,
+                                self.check_qualities.pop(url, ()), online=online)
             self.streams.append(new_stream)
+            self.index_stream(new_stream)
+            self.record_check(new_stream)
             self.no_streams = False
             self.refilter_streams()
             self.sync_store()
@@ -822,10 +1728,14 @@ class StreamList(object):
             return
         pad = self.pads[self.current_pad]
         s = self.filtered_streams[pad.getyx()[0]]
-        if not self.prompt_confirmation('Delete stream {0}?'.format(s['name'])):
+        if not self.prompt_confirmation('Delete stream {0}?'.format(s.name)):
             return
+        self.cancel_check(s)
         self.filtered_streams.remove(s)
         self.streams.remove(s)
+        self.unindex_stream(s)
+        self.index_filtered_streams()
+        self.delete_history(s)
         pad.deleteln()
         self.sync_store()
         if not self.streams:
@@ -843,10 +1753,10 @@ class StreamList(object):
             return
         pad = self.pads[self.current_pad]
         s = self.filtered_streams[pad.getyx()[0]]
-        if not self.prompt_confirmation('Reset stream {0}?'.format(s['name'])):
+        if not self.prompt_confirmation('Reset stream {0}?'.format(s.name)):
             return
-        s['seen']      = 0
-        s['last_seen'] = 0
+        s.seen      = 0
+        s.last_seen = 0
         self.redraw_current_line()
         self.sync_store()
 
@@ -860,9 +1770,19 @@ class StreamList(object):
             return
         pad = self.pads[self.current_pad]
         s = self.filtered_streams[pad.getyx()[0]]
-        new_val = self.prompt_input('{0} (empty to cancel): '.format(prompt_info[attr]))
+        completions = None
+        if attr == 'res' and s.qualities:
+            completions = s.qualities
+        new_val = self.prompt_input('{0} (empty to cancel): '.format(prompt_info[attr]), completions)
         if new_val != '':
-            s[attr] = new_val
+            if attr == 'url':
+                self.unindex_stream(s)
+            setattr(s, attr, new_val)
+            if attr == 'url':
+                s.qualities = ()
+                dup = self.index_stream(s)
+                if dup:
+                    self.set_footer('Same stream as {0} (id {1})'.format(dup.name, dup.id))
             self.redraw_current_line()
         self.redraw_status()
         self.redraw_stream_footer()
@@ -890,11 +1810,33 @@ class StreamList(object):
             return
         pad = self.pads[self.current_pad]
         s = self.filtered_streams[pad.getyx()[0]]
+        res = quality.select_quality(s.res, s.qualities)
+        r = self.get_relay(s.id)
+        if r:
+            # Already relayed, e.g. being recorded: add the player to it
+            if r.find_consumer(relay.PlayerConsumer):
+                self.set_footer('This stream is already playing')
+            elif not self.config.RELAY_PLAYER:
+                self.set_footer('Set RELAY_PLAYER to watch a stream while recording it')
+            else:
+                try:
+                    r.add_consumer(relay.PlayerConsumer(
+                            format_command(s, shlex.split(self.config.RELAY_PLAYER)), self.player_policy))
+                except OSError as e:
+                    self.set_footer('/!\ Faulty command line: {0}'.format(e.strerror))
+                    return
+                self.bump_stream(s, throttle=True)
+                self.redraw_current_line()
+            return
         try:
-            self.q.put(s, self.cmd)
+            if self.config.RELAY_PLAYER:
+                self.q.put(s, shlex.split(self.config.RELAY_PLAYER), self.start_relay, res=res)
+            else:
+                self.q.put(s, self.cmd, res=res, policy=self.cmd_policies[self.cmd_index])
             self.bump_stream(s, throttle=True)
             self.redraw_current_line()
-            self.refresh_current_pad()
+            if res != s.res:
+                self.set_footer('{0} is not available, playing {1}'.format(s.res, res))
         except Exception as e:
             if type(e) == QueueDuplicate:
                 self.set_footer('This stream is already playing')
@@ -903,12 +1845,98 @@ class StreamList(object):
             else:
                 raise e
 
+    def get_relay(self, idf):
+        """ The running relay of a stream, None if it is not relayed """
+        p = self.q.get_process(idf)
+        if isinstance(p, relay.Relay) and p.poll() is None:
+            return p
+        return None
+
+    def open_relay_stream(self, stream, res=None):
+        """ Open the stream through the Streamlink session, for a relay """
+        streams = self.streamlink.streams(stream.url)
+        if not streams:
+            raise Exception('no stream available')
+        stream.qualities = quality.catalog(streams)
+        res = quality.select_quality(res or stream.res, stream.qualities)
+        if res not in streams:
+            raise Exception('quality {0} not available'.format(res))
+        return streams[res].open()
+
+    def start_relay(self, stream, player_cmd=None, res=None):
+        """ Start fetching a stream in-process, fanned out to player_cmd if given
+
+        Used as a ProcessList callable.
+        """
+        r = relay.Relay(lambda: self.open_relay_stream(stream, res), self.config.RELAY_BUFFER_SIZE,
+                        self.config.RELAY_SLOW_CONSUMERS)
+        if player_cmd:
+            r.add_consumer(relay.PlayerConsumer(format_command(stream, player_cmd), self.player_policy))
+        r.start()
+        if self.relay_server:
+            r.log('Relaying to {0}'.format(self.relay_server.url(stream.id)))
+        return r
+
+    def record_stream(self):
+        """ Start or stop recording the current stream, sharing the download of the player if any """
+        if self.no_stream_shown:
+            return
+        pad = self.pads[self.current_pad]
+        s = self.filtered_streams[pad.getyx()[0]]
+        r = self.get_relay(s.id)
+        if r:
+            recording = r.find_consumer(relay.FileConsumer)
+            if recording:
+                r.remove_consumer(recording)
+                self.set_footer('Stopped recording to {0}'.format(recording.path))
+                self.redraw_current_line()
+                return
+        elif self.q.get_process(s.id):
+            self.set_footer('Set RELAY_PLAYER to record a stream while watching it')
+            return
+        else:
+            try:
+                self.q.put(s, None, self.start_relay,
+                           res=quality.select_quality(s.res, s.qualities))
+            except QueueFull:
+                self.set_footer('Too many streams playing')
+                return
+            r = self.q.get_process(s.id)
+
+        try:
+            rec_dir = os.path.expanduser(self.config.RECORDINGS_DIR)
+            if not os.path.exists(rec_dir):
+                os.makedirs(rec_dir)
+            name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in s.name)
+            path = os.path.join(rec_dir,
+                                '{0}-{1}.ts'.format(name, strftime('%Y%m%d-%H%M%S')))
+            r.add_consumer(relay.FileConsumer(path))
+        except OSError as e:
+            self.set_footer('/!\ Cannot record: {0}'.format(e.strerror))
+            if not r.consumers:
+                self.q.terminate_process(s.id)
+            return
+        self.set_footer('Recording to {0}'.format(path))
+        self.redraw_current_line()
+
     def stop_stream(self):
         if self.no_stream_shown:
             return
         pad = self.pads[self.current_pad]
         s = self.filtered_streams[pad.getyx()[0]]
-        p = self.q.terminate_process(s['id'])
+        r = self.get_relay(s.id)
+        player = r.find_consumer(relay.PlayerConsumer) if r else None
+        if player and [c for c in list(r.consumers) if c is not player and not c.stopped]:
+            # Only stop the player, the recording or HTTP clients go on
+            r.remove_consumer(player)
+            player.close()
+            recording = r.find_consumer(relay.FileConsumer)
+            if recording:
+                self.set_footer('Stopped playing, still recording to {0}'.format(recording.path))
+            else:
+                self.set_footer('Stopped playing, still relaying')
+            return
+        p = self.q.terminate_process(s.id)
         if p:
             self.redraw_current_line()
             self.redraw_stream_footer()
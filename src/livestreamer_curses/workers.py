@@ -0,0 +1,284 @@
+""" Online check workers running in separate processes, possibly on other hosts
+
+The TUI runs a Coordinator which leases checks from its CheckQueue to the
+workers connected to it. Workers pull jobs when they are idle, so faster
+workers get more of them; a worker asking for jobs when the queue is empty
+steals half of the unstarted jobs of the busiest one. Jobs of a worker
+which disconnects are put back in the queue.
+
+Start a worker with:
+
+    LIVESTREAMER_CURSES_AUTHKEY=secret python -m livestreamer_curses.workers HOST:PORT
+
+Messages are tuples sent over multiprocessing connections:
+
+    worker -> coordinator : ('hello', name), ('get', n), ('result', url, status, qualities)
+    coordinator -> worker : ('jobs', urls), ('cancel', urls), ('stop',)
+
+"""
+
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from threading import Thread, Lock
+from subprocess import Popen
+import argparse
+import importlib
+import socket
+import sys
+import os
+
+AUTHKEY_ENV = 'LIVESTREAMER_CURSES_AUTHKEY'
+
+# Number of jobs a worker connection asks for at once
+DEFAULT_BATCH = 4
+
+def parse_address(s):
+    host, _, port = s.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+_session = None
+
+def streamlink_check(url):
+    """ Default check: returns (status, quality names) like StreamList._check_stream """
+    global _session
+    if _session is None:
+        import streamlink
+        _session = streamlink.Streamlink()
+    try:
+        streams = _session.resolve_url(url).get_streams()
+    except Exception:
+        return 3, []
+    if streams:
+        return 1, list(streams)
+    return 0, []
+
+class Lease(object):
+    """ A connected worker and the jobs leased to it, oldest first """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.urls = []
+        self.done = 0
+        self.send_lock = Lock()
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+class Coordinator(object):
+    """ Serve the checks of a CheckQueue to remote workers """
+
+    def __init__(self, checks, address, authkey, on_result=None, batch=DEFAULT_BATCH, metrics=None):
+        """ Create a Coordinator
+
+        checks    : checker.CheckQueue to take the jobs from
+        address   : (host, port) to listen on, port 0 for any free port
+        authkey   : bytes shared with the workers
+        on_result : optional callable(url, status, qualities), called from
+                    the connection threads before the result is published
+        metrics   : optional metrics.Metrics to count jobs in
+
+        """
+        self.checks    = checks
+        self.on_result = on_result
+        self.batch     = batch
+        self.metrics   = metrics
+        self.listener  = Listener(address, backlog=64, authkey=authkey)
+        self.address   = self.listener.address
+        self.leases    = []
+        self.lock      = Lock()
+
+    def start(self):
+        t = Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError, IOError):
+                continue
+            except (OSError, socket.error):
+                return
+            t = Thread(target=self.handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def count(self, name, help, n=1):
+        if self.metrics:
+            self.metrics.counter(name, help).inc(n)
+
+    def handle(self, conn):
+        lease = None
+        try:
+            msg = conn.recv()
+            lease = Lease(conn, msg[1] if msg[0] == 'hello' else 'anonymous')
+            with self.lock:
+                self.leases.append(lease)
+            while True:
+                msg = conn.recv()
+                if msg[0] == 'get':
+                    urls = self.next_jobs(lease, min(msg[1], self.batch))
+                    if urls is None:
+                        lease.send(('stop',))
+                        return
+                    lease.send(('jobs', urls))
+                elif msg[0] == 'result':
+                    url, status, qualities = msg[1:]
+                    with self.lock:
+                        if url in lease.urls:
+                            lease.urls.remove(url)
+                    if self.on_result and status is not None:
+                        self.on_result(url, status, qualities)
+                    if self.checks.complete(lease, url, status):
+                        lease.done += 1
+                        self.count('worker_jobs_total', 'Checks completed by remote workers')
+        except (EOFError, IOError, OSError, socket.error):
+            pass
+        finally:
+            if lease:
+                with self.lock:
+                    self.leases.remove(lease)
+                    lost = list(lease.urls)
+                if lost:
+                    n = self.checks.requeue(lease, lost)
+                    self.count('worker_jobs_requeued_total', 'Checks given back after a worker was lost', n)
+            conn.close()
+
+    def next_jobs(self, lease, n):
+        """ Wait for jobs for lease, taken from the queue or stolen from another worker """
+        timeout = 0
+        while True:
+            urls = self.checks.take(lease, n, timeout)
+            if urls is None:
+                return None
+            if not urls:
+                urls = self.steal(lease, n)
+            if urls:
+                with self.lock:
+                    lease.urls.extend(urls)
+                return urls
+            timeout = 1
+
+    def steal(self, thief, n):
+        """ Take up to half of the unstarted jobs of the busiest worker """
+        with self.lock:
+            victims = [l for l in self.leases if l is not thief and len(l.urls) > 1]
+            if not victims:
+                return []
+            victim = max(victims, key=lambda l: len(l.urls))
+            # The first job is probably being checked, take from the end
+            k = min(n, len(victim.urls) // 2)
+            urls = [url for url in victim.urls[-k:] if self.checks.reassign(url, victim, thief)]
+            for url in urls:
+                victim.urls.remove(url)
+        if urls:
+            try:
+                victim.send(('cancel', urls))
+            except (IOError, OSError):
+                pass
+            self.count('worker_jobs_stolen_total', 'Checks moved from a busy worker to an idle one', len(urls))
+        return urls
+
+    def workers(self):
+        """ List of (name, leased jobs, completed jobs) of the connected workers """
+        with self.lock:
+            return [(l.name, len(l.urls), l.done) for l in self.leases]
+
+    def close(self):
+        self.listener.close()
+
+def spawn_local_workers(n, address, authkey, threads=1):
+    """ Start n worker processes connecting to address, returns their Popen objects """
+    env = dict(os.environ)
+    env[AUTHKEY_ENV] = authkey.decode('ascii') if isinstance(authkey, bytes) else authkey
+    cmd = [sys.executable, '-m', 'livestreamer_curses.workers',
+           '{0}:{1}'.format(*address), '--threads', str(threads)]
+    with open(os.devnull, 'wb') as devnull:
+        return [Popen(cmd + ['--name', 'local-{0}'.format(i+1)], env=env,
+                      stdout=devnull, stderr=devnull)
+                for i in range(n)]
+
+def run_connection(address, authkey, name, check, batch):
+    """ Pull and check jobs until the coordinator stops or goes away """
+    conn = Client(address, authkey=authkey)
+    conn.send(('hello', name))
+    cancelled = set()
+
+    def read_cancellations():
+        while conn.poll():
+            msg = conn.recv()
+            if msg[0] == 'cancel':
+                cancelled.update(msg[1])
+            elif msg[0] == 'stop':
+                return False
+        return True
+
+    try:
+        while True:
+            conn.send(('get', batch))
+            while True:
+                msg = conn.recv()
+                if msg[0] == 'jobs':
+                    break
+                elif msg[0] == 'cancel':
+                    cancelled.update(msg[1])
+                elif msg[0] == 'stop':
+                    return
+            for url in msg[1]:
+                if not read_cancellations():
+                    return
+                if url in cancelled:
+                    cancelled.discard(url)
+                    continue
+                try:
+                    status, qualities = check(url)
+                except Exception:
+                    status, qualities = 3, []
+                conn.send(('result', url, status, qualities))
+            cancelled.clear()
+    except (EOFError, IOError, OSError):
+        pass
+    finally:
+        conn.close()
+
+def load_checker(spec):
+    """ Import a check function given as 'module:function' """
+    module, _, func = spec.partition(':')
+    return getattr(importlib.import_module(module), func or 'check')
+
+def main():
+    parser = argparse.ArgumentParser(description='livestreamer-curses online check worker.')
+    parser.add_argument('address', help='HOST:PORT of the coordinator (CHECK_WORKERS_ADDRESS)')
+    parser.add_argument('--threads', type=int, default=4, help='parallel checks. default: %(default)s')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH,
+                        help='jobs requested at once by each thread. default: %(default)s')
+    parser.add_argument('--name', default=socket.gethostname(), help='name shown by the coordinator')
+    parser.add_argument('--checker', metavar='MODULE:FUNCTION',
+                        help='function taking a URL and returning (status, quality names). '
+                             'default: check with streamlink')
+    args = parser.parse_args()
+
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        parser.error('the shared key must be set in ${0}'.format(AUTHKEY_ENV))
+    check = load_checker(args.checker) if args.checker else streamlink_check
+    address = parse_address(args.address)
+
+    threads = []
+    for i in range(args.threads):
+        t = Thread(target=run_connection,
+                   args=(address, authkey.encode('ascii'), '{0}/{1}'.format(args.name, i+1), check, args.batch))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()